@@ -4,8 +4,11 @@
 from __future__ import generator_stop
 
 import collections
+import cProfile
 import functools
+import io
 import os
+import sys
 from typing import AsyncIterable
 from typing import List
 
@@ -17,7 +20,10 @@ from . import asynch
 from . import config
 from . import interfaces
 from . import interpret
+from . import loopstats
 from . import plug
+from . import stats
+from . import tracing
 
 
 async def call_traversal(
@@ -25,8 +31,15 @@ async def call_traversal(
     traversal: interfaces.Traversal,
     items: AsyncIterable,
     exit_stack: async_exit_stack.AsyncExitStack,
+    stage_stats: stats.StageStats = None,
+    stage_tracer: tracing.StageTracer = None,
 ):
-    runtime_parameters = {"items": items, "exit_stack": exit_stack}
+    runtime_parameters = {
+        "items": items,
+        "exit_stack": exit_stack,
+        "stats": stage_stats,
+        "trace": stage_tracer,
+    }
 
     calculated_params = traversal.plugin_object.calculate_more_params(traversal)
 
@@ -44,27 +57,145 @@ async def call_traversal(
     return await traversal.plugin_object.traversal_function(**args)
 
 
+FUSIBLE_TRAVERSALS = ["map", "filter"]
+
+
+def _precalculated(plugin_object, params):
+    return attr.evolve(plugin_object, calculate_more_params=lambda traversal: params)
+
+
+def fuse_traversals(traversals: List[interfaces.Traversal]):
+    """Merge runs of adjacent synchronous ``map`` and ``filter`` stages.
+
+    Each run becomes a single ``fused`` traversal, so every item crosses one
+    async iteration boundary per run instead of one per stage. Stages that use
+    ``await`` or ``--batch-size`` are left alone.
+    """
+    fused_traversals = []
+    run: List = []
+
+    def flush():
+        if len(run) == 1:
+            traversal, params = run[0]
+            fused_traversals.append(
+                attr.evolve(
+                    traversal,
+                    plugin_object=_precalculated(traversal.plugin_object, params),
+                )
+            )
+        elif run:
+            stages = [t.specific_invocation_params.get("stage") for t, _ in run]
+            label = None
+            if None not in stages:
+                label = f"stages {stages[0]}-{stages[-1]}: fused"
+            function = interpret.build_fused_function(
+                [(t.plugin_object.name, params["function"]) for t, params in run], label
+            )
+            # pylint: disable=unsubscriptable-object
+            plugin_object = _precalculated(
+                get_global_registry().traversals["fused"], {"function": function}
+            )
+            fused_traversals.append(
+                attr.evolve(
+                    run[0][0],
+                    specific_invocation_params={
+                        "name": "fused",
+                        "parameters": {},
+                        "label": label or "fused",
+                    },
+                    plugin_object=plugin_object,
+                )
+            )
+        run.clear()
+
+    for traversal in traversals:
+        if traversal.plugin_object.name in FUSIBLE_TRAVERSALS:
+            params = traversal.plugin_object.calculate_more_params(traversal)
+            function = params.get("function")
+            if params.get("batch_size", 1) == 1 and not getattr(
+                function, "is_async", True
+            ):
+                run.append((traversal, params))
+                continue
+            flush()
+            fused_traversals.append(
+                attr.evolve(
+                    traversal,
+                    plugin_object=_precalculated(traversal.plugin_object, params),
+                )
+            )
+            continue
+
+        flush()
+        fused_traversals.append(traversal)
+
+    flush()
+    return fused_traversals
+
+
 async def program_runner(
     traversals: List[interfaces.Traversal],
     items: AsyncIterable,
     context: interfaces.Context,
+    stage_stats: List[stats.StageStats] = None,
+    tracer: tracing.Tracer = None,
 ):
+    """Connect the traversals, returning the exit stack and the final items.
+
+    If ``stage_stats`` is a list, the input and the output of each traversal
+    are metered, and their :class:`stats.StageStats` are appended to it. If
+    ``tracer`` is given, traversals that support it record spans in it.
+    """
     async with async_exit_stack.AsyncExitStack() as stack:
+        producer = consumer = stage_tracer = None
+        if stage_stats is not None:
+            producer = stats.StageStats("input")
+            stage_stats.append(producer)
+
         for traversal in traversals:
-            items = await call_traversal(context, traversal, items, stack)
+            params = traversal.specific_invocation_params
+            label = params.get("label", params["name"])
+            if stage_stats is not None:
+                consumer = stats.StageStats(label)
+                stage_stats.append(consumer)
+                items = stats.Meter(items, producer, consumer).metered()
+                producer = consumer
+            if tracer is not None:
+                stage_tracer = tracer.stage(label)
+            items = await call_traversal(
+                context, traversal, items, stack, consumer, stage_tracer
+            )
+
+        if stage_stats is not None:
+            items = stats.Meter(items, producer).metered()
 
         return stack.pop_all(), items
 
 
-async def async_main(basic_traversals, **kwargs):
-    # pylint: disable=protected-access
-    stream = trio.hazmat.FdStream(os.dup(0))
-    receiver = asynch.TerminatedFrameReceiver(stream, b"\n")
+async def async_main(
+    basic_traversals, input_stream=None, output_stream=None, stats_file=None, **kwargs
+):
+    """Run the pipeline over lines read from ``input_stream``.
+
+    The streams default to the process's stdin and stdout. Results are written
+    to ``output_stream`` one per line. The ``--stats`` table is written to the
+    text file ``stats_file``, by default stderr.
+    """
+    if input_stream is None:
+        receiver = asynch.open_frame_batch_receiver(0, b"\n", encoding="utf-8")
+    else:
+        receiver = asynch.TerminatedFrameBatchReceiver(
+            input_stream, b"\n", encoding="utf-8"
+        )
 
-    # pylint: disable=no-member
+    global_registry = get_global_registry()
     global_context = interfaces.Context(global_registry.global_options.copy())
     global_context.global_options.update(config.DEFAULTS)
     global_context.global_options.update(kwargs)
+    if global_context.global_options["max_buffered"] is None:
+        global_context.global_options["max_buffered"] = max(
+            config.DEFAULT_MAX_BUFFERED, global_context.global_options["max_concurrent"]
+        )
 
     global_context.global_options[
         "global_namespace"
@@ -76,41 +207,137 @@ async def async_main(basic_traversals, **kwargs):
         interpret.build_global_namespace(global_context.global_options["exec_before"])
     )
     traversals = []
+    stages = (d for bt in basic_traversals for d in bt)
 
-    for bt in basic_traversals:
-
-        for d in bt:
-            # pylint: disable=fixme
-            # TODO Make classes or use pyrsistent.
-            traversal_namespace = {
-                **global_context.global_options["global_namespace"],
-                **d["parameters"].get("inject_values", {"HELLO": "WORLD"}),
-            }
-            traversal_context = attr.evolve(
-                global_context,
-                global_options=dict(
-                    global_context.global_options, global_namespace=traversal_namespace
-                ),
-            )
-            # pylint: disable=unsubscriptable-object
-            traversal = interfaces.Traversal(
-                global_invocation_options=traversal_context,
-                specific_invocation_params=d,
-                plugin_object=global_registry.traversals[d["name"]],
+    for index, d in enumerate(stages, 1):
+        d = dict(
+            d, stage=index, label=interpret.stage_label(index, d["name"], d.get("code"))
+        )
+        # pylint: disable=fixme
+        # TODO Make classes or use pyrsistent.
+        traversal_namespace = {
+            **global_context.global_options["global_namespace"],
+            **d["parameters"].get("inject_values", {"HELLO": "WORLD"}),
+        }
+        traversal_context = attr.evolve(
+            global_context,
+            global_options=dict(
+                global_context.global_options, global_namespace=traversal_namespace
+            ),
+        )
+        # pylint: disable=unsubscriptable-object
+        traversal = interfaces.Traversal(
+            global_invocation_options=traversal_context,
+            specific_invocation_params=d,
+            plugin_object=global_registry.traversals[d["name"]],
+        )
+        traversals.append(traversal)
+
+    items = asynch.Batched(receiver)
+
+    options = global_context.global_options
+    stage_stats = [] if options["stats"] or options["stats_json"] else None
+    if stage_stats is None:
+        # Statistics are reported per stage, so fused stages are kept apart.
+        traversals = fuse_traversals(traversals)
+    tracer = None if options["trace"] is None else tracing.Tracer()
+    stack, items = await program_runner(
+        traversals, items, global_context, stage_stats, tracer
+    )
+
+    send_options = dict(
+        flush_size=options["flush_size"], flush_interval=options["flush_interval"]
+    )
+
+    try:
+        await _send_output(stack, items, output_stream, send_options)
+    finally:
+        if stage_stats is not None:
+            report_stats(
+                stage_stats, options["stats"], options["stats_json"], stats_file
             )
-            traversals.append(traversal)
+        if tracer is not None:
+            tracer.write(options["trace"])
 
-    items = (item.decode() async for item in receiver)
 
-    stack, items = await program_runner(traversals, items, global_context)
+def report_stats(stage_stats, to_stderr, json_path, file=None):
+    if to_stderr:
+        (file or sys.stderr).write(stats.format_table(stage_stats))
+    if json_path is not None:
+        stats.write_json(stage_stats, json_path)
 
+
+async def _send_output(stack, items, output_stream, send_options):
     async with stack:
-        async for item in items:
-            print(item)
+        if output_stream is not None:
+            await asynch.send_lines(output_stream, items, **send_options)
+            return
+
+        try:
+            output_fd = sys.stdout.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            # stdout has been replaced by an object without a file descriptor.
+            async for item in items:
+                print(item)
+            return
+
+        try:
+            sys.stdout.flush()
+            async with trio.hazmat.FdStream(os.dup(output_fd)) as output:
+                await asynch.send_lines(
+                    output,
+                    items,
+                    encoding=sys.stdout.encoding or "utf-8",
+                    capture_stdout=True,
+                    **send_options,
+                )
+        except (trio.BrokenResourceError, BrokenPipeError):
+            # The reader went away, as in ``mario map x | head -1``. Point stdout
+            # at devnull so flushing it at exit does not fail again.
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, output_fd)
+            os.close(devnull)
+
+
+def make_instruments(options):
+    """Return the Trio instruments that ``options`` ask for."""
+    loop_stats = options.get("loop_stats")
+    loop_stats_file = options.get("loop_stats_file")
+    if not loop_stats and loop_stats_file is None:
+        return []
+    report = loopstats.make_reporter(loop_stats, loop_stats_file)
+    interval = options.get(
+        "loop_stats_interval", config.DEFAULTS["loop_stats_interval"]
+    )
+    return [loopstats.LoopStats(report, interval)]
 
 
 def main(pairs, **kwargs):
-    trio.run(functools.partial(async_main, pairs, **kwargs))
+    run = functools.partial(
+        trio.run,
+        functools.partial(async_main, pairs, **kwargs),
+        instruments=make_instruments(kwargs),
+    )
+    profile_path = kwargs.get("profile")
+    if profile_path is None:
+        run()
+        return
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(run)
+    finally:
+        profiler.dump_stats(profile_path)
+
+
+@functools.lru_cache(maxsize=None)
+def get_global_registry() -> plug.Registry:
+    """Return the registry of all plugins, which is built on first use."""
+    return plug.make_global_registry()
 
 
-global_registry = plug.make_global_registry()
+def __getattr__(name):
+    # Plugins may still read ``app.global_registry``.
+    if name == "global_registry":
+        return get_global_registry()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -3,7 +3,13 @@
 
 from __future__ import generator_stop
 
+import contextlib
+import io
 import itertools
+import mmap
+import os
+import stat
+import threading
 import typing
 
 import trio
@@ -19,6 +25,31 @@ _PYPE_VALUE = "_PYPE_VALUE"
 BUFSIZE = 2 ** 14
 counter = itertools.count()
 _RECEIVE_SIZE = 4096  # pretty arbitrary
+_BATCH_RECEIVE_SIZE = 2 ** 20
+
+_INCOMPLETE_FRAME_MESSAGE = (
+    "Mario cannot parse an incomplete line. "
+    + "Usually this is caused by a missing line feed (\\n) at the end of the input. "
+)
+
+
+class Batched:
+    """An async iterable of items that also exposes the batches they arrive in.
+
+    Traversals that work on whole batches can read ``batches`` directly instead
+    of awaiting each item.
+    """
+
+    def __init__(self, batches: typing.AsyncIterable[typing.List]):
+        self.batches = batches
+
+    def __aiter__(self):
+        return self._items()
+
+    async def _items(self):
+        async for batch in self.batches:
+            for item in batch:
+                yield item
 
 
 class TerminatedFrameReceiver:
@@ -64,8 +95,7 @@ class TerminatedFrameReceiver:
                 if more_data == b"":
                     if self._buf:
                         raise mario.exceptions.IncompleteFrameError(
-                            "Mario cannot parse an incomplete line. "
-                            + "Usually this is caused by a missing line feed (\\n) at the end of the input. "
+                            _INCOMPLETE_FRAME_MESSAGE
                         )
                     raise trio.EndOfChannel
                 self._buf += more_data
@@ -87,3 +117,294 @@ class TerminatedFrameReceiver:
             return await self.receive()
         except trio.EndOfChannel:
             raise StopAsyncIteration
+
+
+class TerminatedFrameBatchReceiver:
+    """Parse batches of frames out of a Trio stream, where each frame is
+    terminated by a fixed byte sequence.
+
+    Each call to ``receive`` reads a large chunk from the stream and returns
+    every complete frame in the buffer as a list, splitting them in one call
+    instead of searching for each terminator separately. If ``encoding`` is
+    given, the complete frames are decoded together and returned as strings.
+
+    Frames longer than ``max_frame_length`` are rejected, as in
+    :class:`TerminatedFrameReceiver`.
+    """
+
+    def __init__(
+        self,
+        stream: trio.abc.ReceiveStream,
+        terminator: bytes,
+        max_frame_length: int = 16384,
+        receive_size: int = _BATCH_RECEIVE_SIZE,
+        encoding: typing.Optional[str] = None,
+    ) -> None:
+        self.stream = stream
+        self.terminator = terminator
+        self.max_frame_length = max_frame_length
+        self.receive_size = receive_size
+        self.encoding = encoding
+        self._buf = bytearray()
+
+    async def receive(self) -> typing.List[typing.Union[bytes, str]]:
+        while True:
+            more_data = await self.stream.receive_some(self.receive_size)
+            if more_data == b"":
+                if self._buf:
+                    raise mario.exceptions.IncompleteFrameError(
+                        _INCOMPLETE_FRAME_MESSAGE
+                    )
+                raise trio.EndOfChannel
+
+            # The buffer never holds a terminator between calls, so only the
+            # new data and a possible partial terminator before it are searched.
+            search_start = max(0, len(self._buf) - len(self.terminator) + 1)
+            self._buf += more_data
+            end = self._buf.rfind(self.terminator, search_start)
+            if end < 0:
+                if len(self._buf) > self.max_frame_length:
+                    raise ValueError("frame too long")
+                continue
+
+            chunk = bytes(self._buf[:end])
+            del self._buf[: end + len(self.terminator)]
+            if len(self._buf) > self.max_frame_length:
+                raise ValueError("frame too long")
+
+            if self.encoding is None:
+                frames = chunk.split(self.terminator)
+            else:
+                frames = chunk.decode(self.encoding).split(
+                    self.terminator.decode(self.encoding)
+                )
+
+            if len(chunk) > self.max_frame_length and (
+                max(map(len, frames)) > self.max_frame_length
+            ):
+                raise ValueError("frame too long")
+
+            return frames
+
+    async def receive_rest(self, convert: typing.Callable[[memoryview], T]) -> T:
+        """Receive the rest of the stream at once, without splitting it into frames.
+
+        ``convert`` is called with a view of the data and its result is
+        returned.
+        """
+        while True:
+            more_data = await self.stream.receive_some(self.receive_size)
+            if more_data == b"":
+                break
+            self._buf += more_data
+        with memoryview(self._buf) as view:
+            result = convert(view)
+        self._buf = bytearray()
+        return result
+
+    def __aiter__(self) -> "TerminatedFrameBatchReceiver":
+        return self
+
+    async def __anext__(self) -> typing.List[typing.Union[bytes, str]]:
+        try:
+            return await self.receive()
+        except trio.EndOfChannel:
+            raise StopAsyncIteration
+
+
+class MappedFrameBatchReceiver:
+    """Parse batches of frames out of a memory mapped file.
+
+    This works like :class:`TerminatedFrameBatchReceiver`, but each batch is
+    split and decoded straight from the mapping, without read calls or copies
+    into a buffer. Frames start at ``offset``.
+    """
+
+    def __init__(
+        self,
+        mapped: mmap.mmap,
+        terminator: bytes,
+        offset: int = 0,
+        max_frame_length: int = 16384,
+        receive_size: int = _BATCH_RECEIVE_SIZE,
+        encoding: typing.Optional[str] = None,
+    ) -> None:
+        self.mapped = mapped
+        self.terminator = terminator
+        self.max_frame_length = max_frame_length
+        self.receive_size = receive_size
+        self.encoding = encoding
+        self._view = memoryview(mapped)
+        self._pos = offset
+        self._released = 0
+
+    async def receive(self) -> typing.List[typing.Union[bytes, str]]:
+        await trio.hazmat.checkpoint()
+        start = self._pos
+        self._release(start)
+        if start >= len(self.mapped):
+            raise trio.EndOfChannel
+
+        # Search far enough to find the end of any frame that is not too long.
+        size = max(self.receive_size, self.max_frame_length + len(self.terminator))
+        end = self.mapped.rfind(self.terminator, start, start + size)
+        if end < 0:
+            if len(self.mapped) - start > self.max_frame_length:
+                raise ValueError("frame too long")
+            raise mario.exceptions.IncompleteFrameError(_INCOMPLETE_FRAME_MESSAGE)
+        self._pos = end + len(self.terminator)
+
+        with self._view[start:end] as chunk:
+            if self.encoding is None:
+                frames = bytes(chunk).split(self.terminator)
+            else:
+                frames = str(chunk, self.encoding).split(
+                    self.terminator.decode(self.encoding)
+                )
+
+        if end - start > self.max_frame_length and (
+            max(map(len, frames)) > self.max_frame_length
+        ):
+            raise ValueError("frame too long")
+
+        return frames
+
+    async def receive_rest(self, convert: typing.Callable[[memoryview], T]) -> T:
+        """Receive the rest of the file at once, without splitting it into frames.
+
+        ``convert`` is called with a view of the mapping, so the data is not
+        copied before ``convert`` reads it.
+        """
+        await trio.hazmat.checkpoint()
+        with self._view[self._pos :] as view:
+            result = convert(view)
+        self._pos = len(self.mapped)
+        return result
+
+    def _release(self, end: int) -> None:
+        """Unmap the pages before ``end``, which have been parsed already.
+
+        This keeps the resident memory of long files flat. The pages stay in
+        the page cache.
+        """
+        if not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        end -= end % mmap.PAGESIZE
+        if end > self._released:
+            length = end - self._released
+            self.mapped.madvise(mmap.MADV_DONTNEED, self._released, length)
+            self._released = end
+
+    def __aiter__(self) -> "MappedFrameBatchReceiver":
+        return self
+
+    async def __anext__(self) -> typing.List[typing.Union[bytes, str]]:
+        try:
+            return await self.receive()
+        except trio.EndOfChannel:
+            raise StopAsyncIteration
+
+
+def open_frame_batch_receiver(
+    fd: int, terminator: bytes, encoding: typing.Optional[str] = None
+) -> typing.Union[TerminatedFrameBatchReceiver, MappedFrameBatchReceiver]:
+    """Receive batches of frames from the file descriptor ``fd``.
+
+    Regular files are memory mapped from their current offset. Pipes,
+    terminals and empty files are read as a stream.
+    """
+    status = os.fstat(fd)
+    offset = os.lseek(fd, 0, os.SEEK_CUR) if stat.S_ISREG(status.st_mode) else 0
+    if not stat.S_ISREG(status.st_mode) or status.st_size <= offset:
+        stream = trio.hazmat.FdStream(os.dup(fd))
+        return TerminatedFrameBatchReceiver(stream, terminator, encoding=encoding)
+
+    mapped = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    if hasattr(mapped, "madvise"):
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+    return MappedFrameBatchReceiver(mapped, terminator, offset, encoding=encoding)
+
+
+class _TextBuffer(io.TextIOBase):
+    """Text waiting to be sent, which other threads may also write to."""
+
+    def __init__(self, encoding: str):
+        super().__init__()
+        self._encoding = encoding
+        self._lock = threading.Lock()
+        self._parts: typing.List[str] = []
+        self.size = 0
+
+    @property
+    def encoding(self):
+        return self._encoding
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        with self._lock:
+            self._parts.append(text)
+            self.size += len(text)
+        return len(text)
+
+    def take(self) -> str:
+        with self._lock:
+            parts, self._parts, self.size = self._parts, [], 0
+        return "".join(parts)
+
+
+async def send_lines(
+    stream: trio.abc.SendStream,
+    items: typing.AsyncIterable,
+    flush_size: int = _BATCH_RECEIVE_SIZE,
+    flush_interval: typing.Optional[float] = None,
+    encoding: str = "utf-8",
+    capture_stdout: bool = False,
+) -> None:
+    """Write each item and a line feed to ``stream``, like ``print``, in bulk.
+
+    Output is buffered until roughly ``flush_size`` characters are waiting,
+    or until ``flush_interval`` seconds have passed since the last write, so a
+    slow pipeline still shows its results promptly. With ``capture_stdout``,
+    text written to ``sys.stdout`` meanwhile, e.g. by ``print`` in a stage, is
+    buffered with the items so that it keeps its place in the output.
+    """
+    buffer = _TextBuffer(encoding)
+    lock = trio.Lock()
+
+    async def flush():
+        # Take the buffer only once the lock is held, so that cancelling the
+        # periodic flush at the end never drops output it has already taken.
+        async with lock:
+            text = buffer.take()
+            if text:
+                await stream.send_all(text.encode(encoding))
+
+    async def flush_periodically():
+        while True:
+            await trio.sleep(flush_interval)
+            await flush()
+
+    if isinstance(items, Batched):
+        batches = items.batches
+    else:
+        batches = ([item] async for item in items)  # pylint: disable=not-an-iterable
+
+    if capture_stdout:
+        redirect = contextlib.redirect_stdout(buffer)
+    else:
+        redirect = contextlib.nullcontext()
+    async with trio.open_nursery() as nursery:
+        if flush_interval:
+            nursery.start_soon(flush_periodically)
+
+        with redirect:
+            async for batch in batches:
+                if batch:
+                    buffer.write("\n".join(map(str, batch)) + "\n")
+                if buffer.size >= flush_size:
+                    await flush()
+
+        await flush()
+        nursery.cancel_scope.cancel()
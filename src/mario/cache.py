@@ -0,0 +1,84 @@
+"""On-disk cache of compiled user code.
+
+Entries are marshalled values stored in files named after a hash of their key.
+The cache is bounded by total size; the least recently used entries are
+removed first.
+"""
+
+import contextlib
+import hashlib
+import importlib.util
+import marshal
+import os
+import pathlib
+import tempfile
+
+import appdirs
+
+import mario
+
+from . import utils
+
+
+MAX_SIZE = 2 ** 24
+
+
+def get_cache_dir() -> pathlib.Path:
+    str_path = os.environ.get(f"{utils.NAME}_CACHE_DIR".upper()) or (
+        appdirs.user_cache_dir(utils.NAME)
+    )
+    return pathlib.Path(str_path) / "functions"
+
+
+def make_key(*parts: str) -> str:
+    """Hash ``parts`` together with the mario version and bytecode format."""
+    digest = hashlib.sha256()
+    for part in [mario.__version__, importlib.util.MAGIC_NUMBER.hex(), *parts]:
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def load(key: str):
+    """Return the value stored under ``key``, or ``None``."""
+    path = get_cache_dir() / key
+    try:
+        data = path.read_bytes()
+        os.utime(path)
+        return marshal.loads(data)
+    except (OSError, ValueError, EOFError, TypeError):
+        return None
+
+
+def store(key: str, value, max_size: int = MAX_SIZE) -> None:
+    """Store ``value`` under ``key`` and evict old entries beyond ``max_size``.
+
+    Errors writing the cache are ignored.
+    """
+    cache_dir = get_cache_dir()
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, prefix=".")
+        with os.fdopen(fd, "wb") as f:
+            marshal.dump(value, f)
+        os.replace(temp_path, cache_dir / key)
+        evict(cache_dir, max_size)
+    except (OSError, ValueError):
+        pass
+
+
+def evict(cache_dir: pathlib.Path, max_size: int) -> None:
+    """Remove the least recently used entries until the total is within ``max_size``."""
+    entries = []
+    for path in cache_dir.iterdir():
+        with contextlib.suppress(OSError):
+            stat = path.stat()
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        with contextlib.suppress(OSError):
+            path.unlink()
+        total -= size
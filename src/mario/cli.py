@@ -1,3 +1,4 @@
+import collections.abc
 import os
 import sys
 
@@ -9,6 +10,7 @@ import mario.doc
 from . import app
 from . import cli_tools
 from . import config
+from . import tracing
 from . import utils
 
 
@@ -154,10 +156,15 @@ Configuration:
 """
 
 
-ALIASES = app.global_registry.commands
-
-
 def cli_main(pairs, **kwargs):
+    max_buffered = kwargs.get("max_buffered")
+    if max_buffered is not None and max_buffered < kwargs["max_concurrent"]:
+        raise click.UsageError("--max-buffered must be at least --max-concurrent.")
+    ctx = click.get_current_context()
+    if ctx.obj is not None:
+        # The caller, such as ``mario serve``, runs the pipeline itself.
+        ctx.obj["pipeline"] = (pairs, kwargs)
+        return
     app.main(pairs, **kwargs)
 
 
@@ -201,13 +208,47 @@ def build_stages(command):
     )
 
 
-# pylint: disable=unsupported-assignment-operation
-COMMANDS = app.global_registry.cli_functions
+class LazyCommands(collections.abc.Mapping):
+    """Click commands that are built only when they are looked up.
+
+    The global registry is built on the first lookup. Declarative commands take
+    precedence over plugin functions of the same name.
+    """
+
+    def __init__(self, get_registry):
+        self._get_registry = get_registry
+        self._commands = {}
+
+    def __getitem__(self, name):
+        if name not in self._commands:
+            registry = self._get_registry()
+            if name in registry.commands:
+                self._commands[name] = build_stages(registry.commands[name])
+            else:
+                self._commands[name] = registry.cli_functions[name]
+        return self._commands[name]
+
+    def __setitem__(self, name, command):
+        self._commands[name] = command
+
+    def __contains__(self, name):
+        if name in self._commands:
+            return True
+        registry = self._get_registry()
+        # The plain dict first; the declarative commands answer from their name
+        # index without loading the commands.
+        return name in registry.cli_functions or name in registry.commands
 
-# pylint: disable=no-member
-for k, v in ALIASES.items():
+    def __iter__(self):
+        registry = self._get_registry()
+        names = [*registry.cli_functions, *registry.commands, *self._commands]
+        return iter(dict.fromkeys(names))
 
-    COMMANDS[k] = build_stages(v)
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+COMMANDS = LazyCommands(app.get_global_registry)
 
 
 cli = SectionedGroup(
@@ -218,6 +259,84 @@ cli = SectionedGroup(
         click.Option(
             ["--max-concurrent"], type=int, default=config.DEFAULTS["max_concurrent"]
         ),
+        click.Option(
+            ["--max-buffered"],
+            type=int,
+            default=config.DEFAULTS["max_buffered"],
+            help="Maximum number of items an async traversal reads ahead of its output. "
+            "Bounds memory when an early item is slow. Must be at least "
+            f"--max-concurrent. [default: {config.DEFAULT_MAX_BUFFERED} or "
+            "--max-concurrent, whichever is larger]",
+        ),
+        click.Option(
+            ["--flush-size"],
+            type=int,
+            default=config.DEFAULTS["flush_size"],
+            help="Number of characters of output to buffer before writing to stdout.",
+        ),
+        click.Option(
+            ["--flush-interval"],
+            type=float,
+            default=config.DEFAULTS["flush_interval"],
+            help="Maximum number of seconds buffered output waits before it is written. "
+            "Use 0 to write only when the buffer is full or the input ends.",
+        ),
+        click.Option(
+            ["--no-cache"],
+            is_flag=True,
+            default=config.DEFAULTS["no_cache"],
+            help="Compile the code of each stage instead of reusing compiled code "
+            "from the on-disk cache.",
+        ),
+        click.Option(
+            ["--profile"],
+            type=click.Path(dir_okay=False, writable=True),
+            default=config.DEFAULTS["profile"],
+            help="Run the pipeline under cProfile and write the stats to this file. "
+            "Functions are named after their stages, e.g. stage 2: map 'json.loads'.",
+        ),
+        click.Option(
+            ["--stats"],
+            is_flag=True,
+            default=config.DEFAULTS["stats"],
+            help="Print the number of items, throughput and time spent in each stage "
+            "to stderr at exit. Async stages also report per-item latency percentiles "
+            "and the peak number of items in flight.",
+        ),
+        click.Option(
+            ["--stats-json"],
+            type=click.Path(dir_okay=False, writable=True),
+            default=config.DEFAULTS["stats_json"],
+            help="Write the statistics of --stats to this file as JSON.",
+        ),
+        click.Option(
+            ["--trace"],
+            type=click.Path(dir_okay=False, writable=True),
+            default=config.DEFAULTS["trace"],
+            help="Write the phases of each item of async stages to this file as "
+            "Chrome trace events, for chrome://tracing or ui.perfetto.dev. "
+            f"Only the last {tracing.MAX_SPANS} spans are kept.",
+        ),
+        click.Option(
+            ["--loop-stats"],
+            is_flag=True,
+            default=config.DEFAULTS["loop_stats"],
+            help="Print event loop statistics to stderr periodically: scheduler lag, "
+            "task counts and the longest stretches of code that ran without "
+            "yielding to other tasks, named after their stages.",
+        ),
+        click.Option(
+            ["--loop-stats-file"],
+            type=click.Path(dir_okay=False, writable=True),
+            default=config.DEFAULTS["loop_stats_file"],
+            help="Write the statistics of --loop-stats to this file as JSON lines.",
+        ),
+        click.Option(
+            ["--loop-stats-interval"],
+            type=float,
+            default=config.DEFAULTS["loop_stats_interval"],
+            help="Number of seconds between event loop statistics.",
+        ),
         click.Option(
             ["--exec-before"],
             help="Python source code to be executed before any stage.",
@@ -236,6 +355,7 @@ cli = SectionedGroup(
         ),
     ],
     help=doc,
-    commands=COMMANDS,
     sections=mario.doc.SECTION_SPECS,
 )
+# Assigned after construction, because click would count the commands.
+cli.commands = COMMANDS
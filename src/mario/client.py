@@ -0,0 +1,126 @@
+"""Thin client for ``mario serve``.
+
+This module only uses the standard library so that it starts quickly. It
+forwards the command line, the working directory and stdin to a running
+``mario serve`` process over a Unix socket, and copies the output back. If
+no server is listening, it runs ``python -m mario`` instead.
+
+The protocol is a sequence of frames, each a one byte tag, a four byte
+big-endian length and the payload. The client sends one ``a`` frame with a
+JSON object holding ``argv`` and ``cwd``, then ``i`` frames of stdin and an
+empty ``c`` frame at the end of stdin. The server sends ``o`` frames for
+stdout, ``e`` frames for stderr and finally an ``x`` frame with the exit
+status.
+"""
+
+import json
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+
+
+HEADER = struct.Struct(">cI")
+ARGUMENTS = b"a"
+INPUT = b"i"
+INPUT_CLOSED = b"c"
+OUTPUT = b"o"
+ERROR = b"e"
+EXIT = b"x"
+
+READ_SIZE = 2 ** 16
+
+
+def default_socket_path() -> str:
+    """Return the socket path from ``MARIO_SOCKET``, or a per-user default."""
+    return os.environ.get(
+        "MARIO_SOCKET", os.path.join(tempfile.gettempdir(), f"mario-{os.getuid()}.sock")
+    )
+
+
+def encode_frame(tag: bytes, payload: bytes = b"") -> bytes:
+    return HEADER.pack(tag, len(payload)) + payload
+
+
+def _receive_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, READ_SIZE))
+        if not chunk:
+            raise EOFError("mario server closed the connection")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _receive_frame(sock):
+    tag, size = HEADER.unpack(_receive_exactly(sock, HEADER.size))
+    return tag, _receive_exactly(sock, size)
+
+
+def _send_input(sock):
+    try:
+        while True:
+            data = os.read(0, READ_SIZE)
+            if not data:
+                break
+            sock.sendall(encode_frame(INPUT, data))
+        sock.sendall(encode_frame(INPUT_CLOSED))
+    except OSError:
+        # The server stops reading once the pipeline has finished.
+        pass
+
+
+def connect(path: str) -> socket.socket:
+    """Connect to the server at ``path``, which must be owned by this user."""
+    if os.stat(path).st_uid != os.getuid():
+        raise PermissionError(f"{path} is owned by another user")
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def run(argv, sock) -> int:
+    """Run one invocation on the server and return its exit status."""
+    arguments = {"argv": list(argv), "cwd": os.getcwd()}
+    sock.sendall(encode_frame(ARGUMENTS, json.dumps(arguments).encode()))
+    threading.Thread(target=_send_input, args=(sock,), daemon=True).start()
+
+    streams = {OUTPUT: sys.stdout.buffer, ERROR: sys.stderr.buffer}
+    while True:
+        tag, payload = _receive_frame(sock)
+        if tag == EXIT:
+            return int(payload)
+        try:
+            streams[tag].write(payload)
+            streams[tag].flush()
+        except BrokenPipeError:
+            # The reader has gone away, e.g. ``mario-client ... | head``.
+            os.dup2(os.open(os.devnull, os.O_WRONLY), streams[tag].fileno())
+            return 1
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if argv[:1] != ["serve"]:
+        try:
+            sock = connect(default_socket_path())
+        except OSError:
+            pass
+        else:
+            with sock:
+                sys.exit(run(argv, sock))
+
+    os.execv(sys.executable, [sys.executable, "-m", "mario", *argv])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,29 @@
+import functools
 import os
 import pathlib
 
 import appdirs
-import toml
 
 from . import interpret
 from . import utils
 
 
+DEFAULT_MAX_BUFFERED = 1000
+
 DEFAULTS = {
     "max_concurrent": 5,
+    # None reads ahead DEFAULT_MAX_BUFFERED items, or --max-concurrent if larger.
+    "max_buffered": None,
+    "flush_size": 2 ** 16,
+    "flush_interval": 0.1,
+    "no_cache": False,
+    "profile": None,
+    "stats": False,
+    "stats_json": None,
+    "trace": None,
+    "loop_stats": False,
+    "loop_stats_file": None,
+    "loop_stats_interval": 1.0,
     "exec_before": None,
     "autocall": interpret.HowCall.SINGLE,
     "base_exec_before": None,
@@ -22,16 +36,33 @@ def get_config_dir():
     return pathlib.Path(str_path)
 
 
-def load_config(dir_path=None):
+def get_config_path(dir_path=None):
     if dir_path is None:
         config_dir = get_config_dir()
     else:
         config_dir = pathlib.Path(dir_path)
 
-    config_path = config_dir / "config.toml"
+    return config_dir / "config.toml"
+
 
+def load_config(dir_path=None):
+    config_path = get_config_path(dir_path)
+    try:
+        stat = config_path.stat()
+    except OSError:
+        return {}
+
+    return dict(_read_config(config_path, stat.st_mtime_ns, stat.st_size))
+
+
+@functools.lru_cache(maxsize=None)
+def _read_config(config_path, mtime_ns, size):  # pylint: disable=unused-argument
+    """Parse the config file. The result is reused until the file changes."""
     try:
         with open(config_path) as f:
+            # pylint: disable=import-outside-toplevel
+            import toml
+
             return toml.load(f)
     except OSError:
 
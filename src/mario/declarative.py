@@ -1,12 +1,12 @@
-import typing as t
-
-import attr
 import click
 import marshmallow
-import pyrsistent
 from marshmallow import fields
 
 from . import doc
+from .specs import CommandSpec
+from .specs import CommandStage
+from .specs import CommandTest
+from .specs import RemapParam
 
 
 TYPES = {t.__name__: t for t in [int, str, bool, float]}
@@ -126,12 +126,6 @@ class ArgumentSchema(marshmallow.Schema):
         return click.Argument(**validated)
 
 
-@attr.dataclass(frozen=True)
-class RemapParam:
-    new: str
-    old: str
-
-
 class RemapParamSchema(marshmallow.Schema):
     """Translation between the name of a base command's parameter and the name of the new command's parameter."""
 
@@ -143,13 +137,6 @@ class RemapParamSchema(marshmallow.Schema):
         return RemapParam(**validated)
 
 
-@attr.dataclass(frozen=True)
-class CommandStage:
-    command: str
-    remap_params: t.List[RemapParam] = attr.ib(converter=pyrsistent.freeze)
-    params: t.Dict[str, str] = attr.ib(converter=pyrsistent.freeze)
-
-
 class CommandStageSchema(marshmallow.Schema):
     """A single stage of a new command pipeline."""
 
@@ -173,13 +160,6 @@ class CommandStageSchema(marshmallow.Schema):
         return CommandStage(**validated)
 
 
-@attr.dataclass(frozen=True)
-class CommandTest:
-    invocation: t.List[str] = attr.ib(converter=pyrsistent.freeze)
-    input: str
-    output: str
-
-
 class CommandTestSchema(marshmallow.Schema):
     """A test of a new command."""
 
@@ -201,20 +181,6 @@ class CommandTestSchema(marshmallow.Schema):
         return CommandTest(**validated)
 
 
-@attr.dataclass(frozen=True)
-class CommandSpec:
-    name: str
-    short_help: t.Optional[str]
-    help: t.Optional[str]
-    arguments: t.List[click.Argument] = attr.ib(converter=pyrsistent.freeze)
-    options: t.List[click.Option] = attr.ib(converter=pyrsistent.freeze)
-    stages: t.List[CommandStage] = attr.ib(converter=pyrsistent.freeze)
-    inject_values: t.List[str] = attr.ib(converter=pyrsistent.freeze)
-    tests: t.List[CommandTest] = attr.ib(converter=pyrsistent.freeze)
-    section: str
-    hidden: bool
-
-
 class CommandSpecSchema(marshmallow.Schema):
     """A new command."""
 
@@ -87,6 +87,11 @@ SECTION_SPECS = {
         doc="Commands for asynchronously calling code on data.",
         priority=1,
     ),
+    HelpSectionSpec(
+        name="Parallel traversals",
+        doc="Commands for calling code on data in parallel threads or processes.",
+        priority=2,
+    ),
     HelpSectionSpec(name=UNSECTIONED, doc="", priority=UNSECTIONED_PRIORITY),
 }
 
@@ -5,16 +5,20 @@ from __future__ import annotations
 from __future__ import generator_stop
 
 import ast
+import collections
 import enum
 import importlib
+import importlib.util
+import linecache
+import os
 import re
 import sys
 import textwrap
 import types
 
 import attr
-import parso
 
+from . import cache
 
 SYMBOL = "x"
 
@@ -38,52 +42,287 @@ howcall_to_howsig = {v: HowSig.__members__[k] for k, v in HowCall.__members__.it
 
 @attr.dataclass
 class Function:
+    """A function built from user code.
+
+    If ``is_async`` is false, ``wrapped`` is a plain function that can be
+    called without awaiting. Calling the :class:`Function` itself always
+    returns an awaitable.
+    """
+
     wrapped: types.FunctionType
     global_namespace: dict
     source: str
+    is_async: bool = True
+    name: str = None
 
     def __call__(self, *x):
-        return self.wrapped(*x)
+        if self.is_async:
+            return self.wrapped(*x)
+        return _completed(self.wrapped(*x))
+
+
+async def _completed(value):
+    return value
+
+
+@attr.dataclass
+class FunctionSpec:
+    """Picklable recipe for rebuilding a :class:`Function` in another process.
+
+    The namespace is rebuilt in the same order as in the parent process: the
+    ``exec_before`` sources, then ``inject_values``, then the stage's own
+    ``stage_exec_before``.
+    """
+
+    code: str
+    howcall: HowCall
+    exec_before: tuple = ()
+    inject_values: dict = attr.ib(factory=dict)
+    stage_exec_before: str = None
+    use_cache: bool = True
+    name: str = None
+
+    def build(self) -> Function:
+        global_namespace = {}
+        for source in self.exec_before:
+            global_namespace.update(build_global_namespace(source))
+        global_namespace.update(self.inject_values)
+        global_namespace.update(build_global_namespace(self.stage_exec_before))
+        return build_function(
+            self.code,
+            global_namespace,
+            self.howcall,
+            use_cache=self.use_cache,
+            name=self.name,
+        )
+
+
+class MissingModules:
+    """Names that failed to import, remembered across stages.
+
+    The names are kept for one ``sys.path`` and the modification times of its
+    entries, so installing a package or adding a module forgets them.
+    :meth:`load` and :meth:`save` also keep them in the on-disk cache.
+    """
+
+    def __init__(self):
+        self._names = set()
+        self._loaded_key = None
+        self._changed = False
+
+    @staticmethod
+    def _key():
+        parts = []
+        for entry in sys.path:
+            path = entry or os.getcwd()
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                mtime = None
+            parts.append(f"{path}:{mtime}")
+        return cache.make_key("missing-modules", *parts)
+
+    def load(self, use_cache=True):
+        """Forget the names if ``sys.path`` or its entries changed.
+
+        With ``use_cache``, the names for the new key are read from the cache.
+        """
+        key = self._key()
+        if key != self._loaded_key:
+            if self._loaded_key is not None:
+                importlib.invalidate_caches()
+            self._loaded_key = key
+            self._names = set(cache.load(key) or ()) if use_cache else set()
+            self._changed = False
+
+    def save(self):
+        if self._changed and self._loaded_key is not None:
+            cache.store(self._loaded_key, sorted(self._names))
+            self._changed = False
+
+    def add(self, name):
+        self._names.add(name)
+        self._changed = True
+
+    def __contains__(self, name):
+        return name in self._names
+
+
+MISSING_MODULES = MissingModules()
+
+
+class LazyModule(types.ModuleType):
+    """A module that is imported when one of its attributes is first used.
+
+    ``submodules`` are imported at the same time, for dotted names such as
+    ``urllib.parse.urlparse``. Names in it that are not modules are ignored.
+    The attributes of the real module are then copied into the proxy, so later
+    lookups cost the same as on the module itself.
+    """
 
+    def __init__(self, name, submodules=()):
+        super().__init__(name)
+        self.__dict__["_mario_submodules"] = tuple(submodules)
 
-def _get_named_module(name):
-    builtins = sys.modules["builtins"]
-    if hasattr(builtins, name):
-        return builtins
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self.__dict__["__name__"])
+        submodules = self.__dict__.pop("_mario_submodules", None)
+        if submodules is not None:
+            for name in submodules:
+                try:
+                    importlib.import_module(name)
+                except ImportError:
+                    pass
+            self.__dict__.update(module.__dict__)
+        return getattr(module, attribute)
+
+
+def lazy_import(name, submodules=()):
+    """Return the module ``name``, or a :class:`LazyModule` if it is not imported.
+
+    A :class:`LazyModule` is also returned if any of ``submodules`` is not
+    imported yet.
+    """
+    pending = [submodule for submodule in submodules if submodule not in sys.modules]
+    if name in sys.modules and not pending:
+        return sys.modules[name]
+    return LazyModule(name, pending)
+
+
+def lazy_import_names(names):
+    """Map the top-level modules of the dotted ``names`` to lazy imports."""
+    submodules = collections.defaultdict(list)
+    for name in sorted(names):
+        root, _, rest = name.partition(".")
+        submodules[root].extend([name] if rest else [])
+    return {root: lazy_import(root, submodules[root]) for root in submodules}
+
+
+def _is_importable(name):
+    """Return whether the top-level module ``name`` can be imported."""
+    if name in sys.modules:
+        return True
+    if name in MISSING_MODULES:
+        return False
     try:
-        return importlib.import_module(name)
-    except ImportError:
-        pass
-    raise LookupError(f"Could not find {name}")
+        spec = importlib.util.find_spec(name)
+    except (ImportError, ValueError):
+        spec = None
+    if spec is None:
+        MISSING_MODULES.add(name)
+        return False
+    return True
 
 
-def _get_autoimport_module(fullname):
-    name_parts = fullname.split(".")
-    try_names = []
-    for idx in range(len(name_parts)):
-        try_names.insert(0, ".".join(name_parts[: idx + 1]))
+def _is_autoimport_name(fullname):
+    name = fullname.split(".")[0]
+    return not hasattr(sys.modules["builtins"], name) and _is_importable(name)
 
-    name_to_module = {}
-    for name in try_names:
-        try:
-            module = _get_named_module(name)
-        except LookupError:
-            pass
-        else:
-            if module is sys.modules["builtins"]:
-                return {}
-            name_to_module[name] = module
 
-    return name_to_module
+def _dotted_name(node):
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return ".".join(reversed(parts))
 
 
-def find_maybe_module_names(text):
-    # pylint: disable=fixme
-    # TODO: Use a real parser.
-    return re.findall(r"\b[^\d\W]\w*(?:\.[^\d\W]\w*)+\b", text)
+def _target_names(target):
+    return {
+        node.id
+        for node in ast.walk(target)
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store)
+    }
+
+
+class _FreeDottedNames(ast.NodeVisitor):
+    """Collect dotted names such as ``os.path.join`` whose first part is free.
+
+    Names bound by comprehensions, lambdas and assignment expressions, and the
+    names in ``exclude``, are not free.
+    """
+
+    def __init__(self, exclude):
+        self.exclude = set(exclude)
+        self.scopes = [set()]
+        self.names = set()
+
+    def _is_free(self, name):
+        return name not in self.exclude and not any(name in s for s in self.scopes)
+
+    def visit_Attribute(self, node):
+        dotted = _dotted_name(node)
+        if dotted is None:
+            self.generic_visit(node)
+        elif self._is_free(dotted.split(".")[0]):
+            self.names.add(dotted)
+
+    def visit_NamedExpr(self, node):
+        self.visit(node.value)
+        self.scopes[0].add(node.target.id)
+
+    def visit_Lambda(self, node):
+        arguments = node.args
+        for default in arguments.defaults + arguments.kw_defaults:
+            if default is not None:
+                self.visit(default)
+        all_arguments = (
+            getattr(arguments, "posonlyargs", [])
+            + arguments.args
+            + arguments.kwonlyargs
+            + [a for a in [arguments.vararg, arguments.kwarg] if a is not None]
+        )
+        self.scopes.append({a.arg for a in all_arguments})
+        self.visit(node.body)
+        self.scopes.pop()
+
+    def _visit_comprehension(self, node, elements):
+        self.scopes.append(set())
+        for generator in node.generators:
+            self.visit(generator.iter)
+            self.scopes[-1].update(_target_names(generator.target))
+            for condition in generator.ifs:
+                self.visit(condition)
+        for element in elements:
+            self.visit(element)
+        self.scopes.pop()
+
+    def visit_ListComp(self, node):
+        self._visit_comprehension(node, [node.elt])
+
+    visit_SetComp = visit_ListComp
+    visit_GeneratorExp = visit_ListComp
+
+    def visit_DictComp(self, node):
+        self._visit_comprehension(node, [node.key, node.value])
+
+
+def find_maybe_module_names(text, exclude=()):
+    """Find dotted names in the expression ``text`` that may refer to modules.
+
+    Only names whose first part is a free global name are returned. ``x`` and
+    the names in ``exclude`` are skipped.
+    """
+    try:
+        tree = ast.parse(text.strip(), mode="eval")
+    except SyntaxError:
+        # Compiling the stage reports the error.
+        return []
+    finder = _FreeDottedNames({SYMBOL, *exclude})
+    finder.visit(tree)
+    return sorted(finder.names)
 
 
 def split_pipestring(s, sep="!"):
+    if sep not in s:
+        return [s]
+
+    # pylint: disable=import-outside-toplevel
+    import parso
+
     segments = []
     tree = parso.parse(s)
     current_nodes = []
@@ -111,16 +350,49 @@ def make_autocall(expression, howcall):
     return expression + howcall.value
 
 
-def build_source(components, howcall):
+def stage_label(index, command, code=None):
+    """Describe a stage for profilers and tracebacks, e.g. ``stage 3: map 'len'``."""
+    label = f"stage {index}: {command}"
+    if code is not None:
+        code = " ".join(code.split())
+        if len(code) > 40:
+            code = code[:37] + "..."
+        label += f" {code!r}"
+    return label
+
+
+def runner_name(label=None):
+    """Return the name of the function built for the stage ``label``."""
+    if label is None:
+        return "_mario_runner"
+    return "_".join(["_mario", *re.findall(r"\w+", label, re.ASCII)])[:80]
+
+
+def runner_filename(label=None):
+    """Return the file name the function built for ``label`` is compiled with."""
+    if label is None:
+        return "<string>"
+    return f"<{label}>"
+
+
+def register_source(filename, source):
+    """Make ``source`` available to :mod:`linecache`, for tracebacks and profilers."""
+    if filename != "<string>":
+        lines = source.splitlines(keepends=True)
+        linecache.cache[filename] = (len(source), None, lines, filename)
+
+
+def build_source(components, howcall, is_async=True, name="_mario_runner"):
     components = [c.strip() for c in components]
     components = [make_autocall(c, howcall) for c in components]
     indent = "        "
     lines = "".join([f"{indent}{SYMBOL} = {c}\n" for c in components])
 
     howsig = howcall_to_howsig[howcall]
+    prefix = "async " if is_async else ""
     source = textwrap.dedent(
         f"""\
-    async def _mario_runner({howsig.value}):
+    {prefix}def {name}({howsig.value}):
 {lines}
         return {SYMBOL}
     """
@@ -129,33 +401,287 @@ def build_source(components, howcall):
     return source
 
 
-def build_name_to_module(code):
-    name_to_module = {}
+def uses_await(code):
+    """Whether any component of the pipestring ``code`` awaits."""
+    for component in split_pipestring(code):
+        tree = ast.parse(component.strip(), mode="eval")
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.Await, ast.AsyncFor, ast.AsyncWith)):
+                return True
+            if isinstance(node, ast.comprehension) and node.is_async:
+                return True
+    return False
+
+
+def build_batch_source(components, howcall, keep_inputs=False, name="_mario_runner"):
+    """Build a synchronous function that runs the components on a list of items.
+
+    The function returns the list of results. If ``keep_inputs`` is true, it
+    instead returns the input items whose result is true, like ``filter``.
+    """
+    components = [c.strip() for c in components]
+    components = [make_autocall(c, howcall) for c in components]
+    indent = "            "
+    lines = "".join([f"{indent}{SYMBOL} = {c}\n" for c in components])
+    if keep_inputs:
+        keep = f"if {SYMBOL}:\n{indent}    _mario_append(_mario_item)"
+    else:
+        keep = f"_mario_append({SYMBOL})"
+
+    source = textwrap.dedent(
+        f"""\
+    def {name}(_mario_items):
+        _mario_results = []
+        _mario_append = _mario_results.append
+        for _mario_item in _mario_items:
+            {SYMBOL} = _mario_item
+{lines}
+            {keep}
+        return _mario_results
+    """
+    )
+
+    return source
+
+
+def find_module_names(code, exclude=(), use_cache=True):
+    """Find the dotted names in ``code`` that start with an importable module.
+
+    Names in ``exclude`` are skipped. Modules that cannot be found are
+    remembered, and with ``use_cache`` they are also kept in the on-disk cache
+    for later runs.
+    """
+    return _resolve_module_names(code, exclude, use_cache)[0]
+
+
+def _resolve_module_names(code, exclude, use_cache):
+    """Return the names found by :func:`find_module_names` and the rest."""
+    MISSING_MODULES.load(use_cache)
+
     components = split_pipestring(code)
-    module_names = {name for c in components for name in find_maybe_module_names(c)}
-    for name in module_names:
-        name_to_module.update(_get_autoimport_module(name))
+    module_names = {
+        name for c in components for name in find_maybe_module_names(c, exclude)
+    }
+    found = tuple(sorted(filter(_is_autoimport_name, module_names)))
+    unresolved = tuple(sorted(module_names.difference(found)))
+
+    if use_cache:
+        MISSING_MODULES.save()
+    return found, unresolved
 
-    return name_to_module
 
+def build_name_to_module(code, exclude=(), use_cache=True):
+    """Map the modules named in ``code`` to lazy imports, see :class:`LazyModule`."""
+    return lazy_import_names(find_module_names(code, exclude, use_cache))
 
-def build_function(code, global_namespace, howcall):
-    name_to_module = build_name_to_module(code)
+
+@attr.dataclass(frozen=True)
+class CompiledCode:
+    """The result of compiling a pipestring, as stored in the cache.
+
+    ``unresolved_names`` are the free names that were not importable when the
+    code was compiled.
+    """
+
+    source: str
+    code_object: types.CodeType
+    module_names: tuple
+    is_async: bool
+    unresolved_names: tuple
+
+    def import_modules(self):
+        return lazy_import_names(self.module_names)
+
+    def is_stale(self):
+        """Return whether any of the unresolved names can now be imported."""
+        MISSING_MODULES.load()
+        stale = any(map(_is_autoimport_name, self.unresolved_names))
+        MISSING_MODULES.save()
+        return stale
+
+
+def compile_code(
+    kind, code, howcall, make_source, global_namespace=(), use_cache=True, label=None
+):
+    """Compile the source built by ``make_source``, using the on-disk cache.
+
+    ``make_source`` returns the runner source and whether it is async.
+    ``kind`` distinguishes the different runners built from the same code.
+    Names defined in ``global_namespace`` are not autoimported. The source is
+    compiled with the file name for ``label``, see :func:`runner_filename`.
+    Returns the :class:`CompiledCode` and the autoimported modules.
+    """
+    filename = runner_filename(label)
+    defined = sorted(name for name in global_namespace if not name.startswith("__"))
+    key = cache.make_key(kind, howcall.value, code, filename, *defined)
+    entry = cache.load(key) if use_cache else None
+    if entry is not None:
+        try:
+            compiled = CompiledCode(*entry)
+            if not compiled.is_stale():
+                register_source(filename, compiled.source)
+                return compiled, compiled.import_modules()
+        except (TypeError, ImportError):
+            pass
+
+    module_names, unresolved = _resolve_module_names(code, defined, use_cache)
+    name_to_module = lazy_import_names(module_names)
+    source, is_async = make_source()
+    register_source(filename, source)
+    code_object = compile(source, filename, "exec")
+    compiled = CompiledCode(source, code_object, module_names, is_async, unresolved)
+    if use_cache:
+        cache.store(key, attr.astuple(compiled, recurse=False))
+    return compiled, name_to_module
+
+
+def _exec_compiled(compiled, name_to_module, global_namespace, label):
     global_namespace = {**name_to_module, **global_namespace}
+    # pylint: disable=exec-used
+    exec(compiled.code_object, global_namespace)
+    function = global_namespace[runner_name(label)]
+    return Function(
+        function, global_namespace, compiled.source, compiled.is_async, label
+    )
+
+
+def build_function(code, global_namespace, howcall, use_cache=True, name=None):
+    """Build a :class:`Function` that runs the pipestring ``code`` on one item.
+
+    ``name`` labels the stage in profiles and tracebacks, see :func:`stage_label`.
+    """
+
+    def make_source():
+        is_async = uses_await(code)
+        components = split_pipestring(code)
+        source = build_source(components, howcall, is_async, runner_name(name))
+        return source, is_async
+
+    compiled, name_to_module = compile_code(
+        "function", code, howcall, make_source, global_namespace, use_cache, name
+    )
+    return _exec_compiled(compiled, name_to_module, global_namespace, name)
 
-    source = build_source(split_pipestring(code), howcall)
+
+def build_batch_function(
+    code, global_namespace, howcall, keep_inputs=False, use_cache=True, name=None
+):
+    def make_source():
+        components = split_pipestring(code)
+        source = build_batch_source(components, howcall, keep_inputs, runner_name(name))
+        return source, False
+
+    kind = "batch-filter" if keep_inputs else "batch"
+    compiled, name_to_module = compile_code(
+        kind, code, howcall, make_source, global_namespace, use_cache, name
+    )
+    return _exec_compiled(compiled, name_to_module, global_namespace, name)
+
+
+SKIP = object()
+
+
+def build_fused_function(stages, label=None):
+    """Combine consecutive ``map`` and ``filter`` stages into one function.
+
+    ``stages`` is a list of ``(kind, function)`` pairs, where ``kind`` is
+    ``"map"`` or ``"filter"`` and ``function`` is a plain :class:`Function`.
+    Each stage keeps its own global namespace. The fused function returns
+    ``SKIP`` for items that a filter rejects.
+    """
+    runner = runner_name(label)
+    global_namespace = {"_mario_skip": SKIP}
+    indent = "        "
+    lines = []
+    for index, (kind, function) in enumerate(stages):
+        name = f"_mario_stage_{index}"
+        global_namespace[name] = function.wrapped
+        if kind == "filter":
+            lines.append(f"{indent}if not {name}({SYMBOL}):\n")
+            lines.append(f"{indent}    return _mario_skip\n")
+        else:
+            lines.append(f"{indent}{SYMBOL} = {name}({SYMBOL})\n")
+
+    body = "".join(lines)
+    source = textwrap.dedent(
+        f"""\
+    def {runner}({SYMBOL}):
+{body}
+        return {SYMBOL}
+    """
+    )
+
+    filename = runner_filename(label)
+    register_source(filename, source)
     # pylint: disable=exec-used
-    exec(source, global_namespace)
-    function = global_namespace["_mario_runner"]
-    return Function(function, global_namespace, source)
+    exec(compile(source, filename, "exec"), global_namespace)
+    function = global_namespace[runner]
+    return Function(function, global_namespace, source, is_async=False, name=label)
+
+
+class _LazyImports(ast.NodeTransformer):
+    """Replace top-level ``import`` statements with :class:`LazyModule` proxies.
+
+    Statements naming a module that cannot be found are left alone, so that
+    they fail as before. ``from`` imports are left alone too, since the names
+    they bind need not be modules.
+    """
+
+    function_name = "_mario_lazy_import"
+
+    def visit_Module(self, node):
+        body = []
+        for statement in node.body:
+            replacement = self.visit(statement)
+            body.extend(replacement if isinstance(replacement, list) else [replacement])
+        node.body = body
+        return node
+
+    def visit_Import(self, node):
+        roots = {alias.name.split(".")[0] for alias in node.names}
+        if not all(_is_importable(root) for root in roots):
+            return node
+        assignments = []
+        for alias in node.names:
+            if alias.asname is None:
+                target = alias.name.split(".")[0]
+                arguments = [target, [alias.name] if "." in alias.name else []]
+            else:
+                target = alias.asname
+                arguments = [alias.name, []]
+            assignment = ast.Assign(
+                targets=[ast.Name(id=target, ctx=ast.Store())],
+                value=ast.Call(
+                    func=ast.Name(id=self.function_name, ctx=ast.Load()),
+                    args=[ast.parse(repr(a), mode="eval").body for a in arguments],
+                    keywords=[],
+                ),
+            )
+            assignments.append(ast.copy_location(assignment, node))
+        return assignments
+
+    def generic_visit(self, node):
+        # Only top-level statements are rewritten.
+        return node
 
 
 def build_global_namespace(source):
+    """Run ``source`` and return the names it defines.
+
+    Top-level ``import`` statements bind :class:`LazyModule` proxies, so that
+    modules are only imported if a stage uses them.
+    """
     if source is None:
         return {}
     global_namespace = {}
 
+    tree = ast.parse(source)
+    code = compile(
+        ast.fix_missing_locations(_LazyImports().visit(tree)), "<string>", "exec"
+    )
+    global_namespace[_LazyImports.function_name] = lazy_import
     # pylint: disable=exec-used
-    exec(source, global_namespace)
+    exec(code, global_namespace)
+    del global_namespace[_LazyImports.function_name]
 
     return global_namespace
@@ -0,0 +1,177 @@
+"""Event loop statistics for ``mario --loop-stats``.
+
+:class:`LoopStats` is a Trio instrument that measures:
+
+- scheduler lag, the time from a task becoming runnable until it runs;
+- the number of live tasks;
+- run slices, the time a task runs between two checkpoints. A long slice
+  blocks every other task, which usually means blocking code in an async
+  stage, e.g. ``time.sleep`` or ``requests.get`` in ``async-map``.
+
+Tasks that run stage code are named after their stage, so the longest slices
+point at the stage responsible. Synchronous stages run in the main task.
+"""
+
+import heapq
+import json
+import sys
+import time
+import typing as t
+
+import attr
+import trio
+
+
+SLOW_SLICE = 0.05
+LONGEST_SLICES = 3
+
+
+@attr.dataclass
+class Window:
+    """Measurements since the last summary."""
+
+    start: float
+    steps: int = 0
+    run_time: float = 0.0
+    io_wait_time: float = 0.0
+    lag_total: float = 0.0
+    lag_count: int = 0
+    lag_max: float = 0.0
+    slow_slices: int = 0
+    # The longest slice of each task name.
+    longest_slices: t.Dict[str, float] = attr.ib(factory=dict)
+
+
+class LoopStats(trio.abc.Instrument):
+    """Summarize the event loop every ``interval`` seconds and at the end.
+
+    Each summary is passed to ``report`` as a dict.
+    """
+
+    def __init__(
+        self,
+        report: t.Callable[[dict], None],
+        interval: float = 1.0,
+        slow_slice: float = SLOW_SLICE,
+        clock=time.perf_counter,
+    ):
+        self.report = report
+        self.interval = interval
+        self.slow_slice = slow_slice
+        self.clock = clock
+        self.start = clock()
+        self.window = Window(self.start)
+        self.tasks = 0
+        self.peak_tasks = 0
+        self._scheduled = {}
+        self._step_start = None
+        self._io_wait_start = None
+
+    def before_run(self):
+        self.start = self.clock()
+        self.window = Window(self.start)
+
+    def task_spawned(self, task):
+        self.tasks += 1
+        self.peak_tasks = max(self.peak_tasks, self.tasks)
+
+    def task_exited(self, task):
+        self.tasks -= 1
+        self._scheduled.pop(task, None)
+
+    def task_scheduled(self, task):
+        self._scheduled[task] = self.clock()
+
+    def before_task_step(self, task):
+        now = self.clock()
+        scheduled = self._scheduled.pop(task, None)
+        if scheduled is not None:
+            lag = now - scheduled
+            window = self.window
+            window.lag_total += lag
+            window.lag_count += 1
+            window.lag_max = max(window.lag_max, lag)
+        self._step_start = now
+
+    def after_task_step(self, task):
+        now = self.clock()
+        window = self.window
+        duration = now - self._step_start
+        window.steps += 1
+        window.run_time += duration
+        if duration >= self.slow_slice:
+            window.slow_slices += 1
+        if duration > window.longest_slices.get(task.name, 0.0):
+            window.longest_slices[task.name] = duration
+
+        if now - window.start >= self.interval:
+            self.flush(now)
+
+    def before_io_wait(self, timeout):
+        self._io_wait_start = self.clock()
+
+    def after_io_wait(self, timeout):
+        self.window.io_wait_time += self.clock() - self._io_wait_start
+
+    def after_run(self):
+        self.flush(self.clock(), final=True)
+
+    def flush(self, now, final=False):
+        window = self.window
+        elapsed = now - window.start
+        self.report(
+            {
+                "time": now - self.start,
+                "final": final,
+                "tasks": self.tasks,
+                "peak_tasks": self.peak_tasks,
+                "steps": window.steps,
+                "busy": window.run_time / elapsed if elapsed > 0 else 0.0,
+                "io_wait_seconds": window.io_wait_time,
+                "lag_mean_seconds": (
+                    window.lag_total / window.lag_count if window.lag_count else 0.0
+                ),
+                "lag_max_seconds": window.lag_max,
+                "slow_slices": window.slow_slices,
+                "longest_slices": [
+                    {"task": name, "seconds": duration}
+                    for name, duration in heapq.nlargest(
+                        LONGEST_SLICES,
+                        window.longest_slices.items(),
+                        key=lambda item: item[1],
+                    )
+                ],
+            }
+        )
+        self.window = Window(now)
+
+
+def format_summary(summary: dict) -> str:
+    longest = ", ".join(
+        f"{s['task']} {s['seconds'] * 1000:.1f}ms" for s in summary["longest_slices"]
+    )
+    end = " end" if summary["final"] else ""
+    return (
+        f"loop {summary['time']:.1f}s{end}: "
+        f"tasks={summary['tasks']} peak={summary['peak_tasks']} "
+        f"busy={summary['busy']:.0%} "
+        f"lag mean={summary['lag_mean_seconds'] * 1000:.2f}ms "
+        f"max={summary['lag_max_seconds'] * 1000:.2f}ms "
+        f"slow slices={summary['slow_slices']} longest: {longest}\n"
+    )
+
+
+def make_reporter(to_stderr: bool, path: str = None):
+    """Write summaries to stderr, and as JSON lines to ``path`` if it is given."""
+    metrics_file = None if path is None else open(path, "w")
+
+    def report(summary):
+        if to_stderr:
+            sys.stderr.write(format_summary(summary))
+        if metrics_file is not None:
+            metrics_file.write(json.dumps(summary) + "\n")
+            metrics_file.flush()
+            if summary["final"]:
+                metrics_file.close()
+
+    return report
@@ -1,7 +1,12 @@
+import collections
+import collections.abc
+import functools
+import hashlib
 import importlib
 import importlib.resources
 import importlib.util
 import inspect
+import pickle
 import sys
 import types
 import typing as t
@@ -12,10 +17,9 @@ from typing import List
 
 import attr
 import importlib_metadata
-import toml
 
+from mario import cache
 from mario import config
-from mario import declarative
 
 
 @attr.dataclass
@@ -60,6 +64,154 @@ class GlobalOption:
     default: _NoDefaultType
 
 
+def _plain(value):
+    """Convert the mappings and lists made by the TOML parser to builtin types."""
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_plain(v) for v in value]
+    return value
+
+
+def _validate(command_conf):
+    # pylint: disable=import-outside-toplevel
+    from mario import declarative
+
+    return declarative.CommandSpecSchema().load(command_conf)
+
+
+# The pickled commands hold objects from these distributions.
+SNAPSHOT_DEPENDENCIES = ("attrs", "click", "marshmallow", "pyrsistent")
+
+
+@functools.lru_cache(maxsize=None)
+def snapshot_versions() -> t.Tuple[str, ...]:
+    versions = []
+    for name in SNAPSHOT_DEPENDENCIES:
+        try:
+            version = importlib_metadata.version(name)
+        except importlib_metadata.PackageNotFoundError:
+            version = "missing"
+        versions.append(f"{name}=={version}")
+    return tuple(versions)
+
+
+class LazyCommands(collections.abc.Mapping):
+    """Declarative commands that are validated only when first looked up.
+
+    ``load_confs`` returns the parsed configuration mappings. It is called the
+    first time the command names are needed.
+
+    If ``fingerprint`` is given, it returns a string that changes whenever the
+    configuration does. All the commands are then validated once and a pickled
+    snapshot is kept in the cache, so later runs skip parsing and validation.
+    The snapshot is also keyed on the versions of :data:`SNAPSHOT_DEPENDENCIES`,
+    and one that cannot be unpickled is replaced. The command names are cached
+    on their own, so checking whether a command exists does not load the
+    snapshot.
+    """
+
+    def __init__(
+        self,
+        load_confs: t.Callable[[], List[Dict]],
+        fingerprint: t.Optional[t.Callable[[], str]] = None,
+    ):
+        self._load_confs = load_confs
+        self._fingerprint = fingerprint
+        # Maps each name to its raw configuration or to a pickled command.
+        self._confs: t.Optional[Dict[str, t.Union[Dict, bytes]]] = None
+        self._names: t.Optional[t.FrozenSet[str]] = None
+        self._fingerprint_value: t.Optional[str] = None
+        self._commands: Dict[str, Any] = {}
+
+    def _cache_key(self, kind: str, *parts: str) -> str:
+        if self._fingerprint_value is None:
+            self._fingerprint_value = self._fingerprint()
+        return cache.make_key(kind, self._fingerprint_value, *parts)
+
+    def _read_confs(self) -> Dict[str, Dict]:
+        return {
+            command_conf.get("name"): _plain(command_conf)
+            for conf in self._load_confs()
+            for command_conf in conf.get("command", [])
+        }
+
+    def _command_confs(self) -> Dict[str, t.Union[Dict, bytes]]:
+        if self._confs is not None:
+            return self._confs
+
+        if self._fingerprint is None:
+            self._confs = self._read_confs()
+            return self._confs
+
+        snapshot = cache.load(self._cache_key("commands", *snapshot_versions()))
+        if snapshot is None:
+            return self._store_snapshot()
+
+        self._confs = snapshot
+        return self._confs
+
+    def _store_snapshot(self) -> Dict[str, t.Union[Dict, bytes]]:
+        """Validate all the commands and keep them in the cache."""
+        confs = self._read_confs()
+        try:
+            snapshot = {
+                name: pickle.dumps(_validate(command_conf))
+                for name, command_conf in confs.items()
+            }
+        except Exception:  # pylint: disable=broad-except
+            # Report invalid commands only when they are used.
+            self._confs = confs
+            return self._confs
+        cache.store(self._cache_key("commands", *snapshot_versions()), snapshot)
+
+        self._confs = snapshot
+        return self._confs
+
+    def _command_names(self) -> t.FrozenSet[str]:
+        if self._names is not None:
+            return self._names
+
+        if self._confs is not None or self._fingerprint is None:
+            self._names = frozenset(self._command_confs())
+            return self._names
+
+        key = self._cache_key("command-names")
+        names = cache.load(key)
+        if names is None:
+            names = sorted(self._command_confs())
+            cache.store(key, tuple(names))
+        self._names = frozenset(names)
+        return self._names
+
+    def _load_command(self, command_conf):
+        if isinstance(command_conf, bytes):
+            return pickle.loads(command_conf)
+        return _validate(command_conf)
+
+    def __getitem__(self, name):
+        if name not in self._commands:
+            try:
+                command = self._load_command(self._command_confs()[name])
+            except Exception:  # pylint: disable=broad-except
+                if not isinstance(self._confs.get(name), bytes):
+                    raise
+                # The snapshot cannot be unpickled, so validate the
+                # configuration again and replace it.
+                command = self._load_command(self._store_snapshot()[name])
+            self._commands[name] = command
+        return self._commands[name]
+
+    def __contains__(self, name):
+        return name in self._command_names()
+
+    def __iter__(self):
+        return iter(self._command_confs())
+
+    def __len__(self):
+        return len(self._command_names())
+
+
 @attr.s
 class Registry:
     traversals: Dict[str, PluginObject] = attr.ib(factory=dict)
@@ -100,6 +252,7 @@ class Registry:
         return wrap
 
 
+@functools.lru_cache(maxsize=None)
 def plugin_module_paths() -> List[str]:
     return [
         entry_point.value + "." + entry_point.name
@@ -118,12 +271,12 @@ def combine_registries(registries):
     global_options = {}
     traversals = {}
     cli_functions = {}
-    commands = {}
     for registry in registries:
         traversals.update(registry.traversals)
         global_options.update(registry.global_options)
         cli_functions.update(registry.cli_functions)
-        commands.update(registry.commands)
+    # Later registries take precedence, without loading any lazy commands.
+    commands = collections.ChainMap(*[r.commands for r in reversed(registries)])
     return Registry(traversals, global_options, cli_functions, commands)
 
 
@@ -159,33 +312,58 @@ def make_global_registry():
 
 
 def make_commands(conf):
+    # pylint: disable=import-outside-toplevel
+    from mario import declarative
 
     commands = declarative.CommandSpecSchema(many=True).load(conf.get("command", []))
 
     return commands
 
 
-def make_config_commands_registry():
-    conf = config.load_config()
+def config_fingerprint():
+    try:
+        stat = config.get_config_path().stat()
+    except OSError:
+        return "missing"
+    return f"{config.get_config_path()}:{stat.st_mtime_ns}:{stat.st_size}"
+
 
-    commands = make_commands(conf)
-    return Registry(commands={c.name: c for c in commands})
+def make_config_commands_registry():
+    return Registry(
+        commands=LazyCommands(
+            lambda: [config.load_config()], fingerprint=config_fingerprint
+        )
+    )
 
 
-def make_plugin_commands_registry(package="mario.plugins"):
-    plugin_tomls = [
-        filename
+def read_plugin_tomls(package="mario.plugins") -> Dict[str, str]:
+    return {
+        filename: importlib.resources.read_text(package, filename)
         for filename in importlib.resources.contents(package)
         if filename.endswith(".toml")
-    ]
-    confs = [
-        toml.loads(importlib.resources.read_text(package, filename))
-        for filename in plugin_tomls
-    ]
+    }
 
-    conf_command_groups = [make_commands(conf) for conf in confs]
-    registries = [
-        Registry(commands={c.name: c for c in commands})
-        for commands in conf_command_groups
-    ]
-    return combine_registries(registries)
+
+def load_plugin_confs(package="mario.plugins"):
+    # pylint: disable=import-outside-toplevel
+    import toml
+
+    return [toml.loads(text) for text in read_plugin_tomls(package).values()]
+
+
+def plugin_fingerprint(package="mario.plugins"):
+    digest = hashlib.sha256()
+    for part in [package, *plugin_module_paths()]:
+        digest.update(part.encode() + b"\0")
+    for filename, text in sorted(read_plugin_tomls(package).items()):
+        digest.update(filename.encode() + b"\0" + text.encode() + b"\0")
+    return digest.hexdigest()
+
+
+def make_plugin_commands_registry(package="mario.plugins"):
+    return Registry(
+        commands=LazyCommands(
+            lambda: load_plugin_confs(package),
+            fingerprint=lambda: plugin_fingerprint(package),
+        )
+    )
@@ -15,12 +15,7 @@ from mario import traversals
 registry = plug.Registry()
 
 
-def calculate_function(traversal, howcall=None):
-    if howcall is None:
-        howcall = traversal.specific_invocation_params.get("howcall")
-    if howcall is None:
-        howcall = interpret.HowCall.SINGLE
-
+def build_stage_namespace(traversal):
     global_namespace = traversal.global_invocation_options.global_options[
         "global_namespace"
     ].copy()
@@ -32,6 +27,21 @@ def calculate_function(traversal, howcall=None):
             )
         )
 
+    return global_namespace
+
+
+def use_cache(traversal):
+    return not traversal.global_invocation_options.global_options.get("no_cache")
+
+
+def calculate_function(traversal, howcall=None):
+    if howcall is None:
+        howcall = traversal.specific_invocation_params.get("howcall")
+    if howcall is None:
+        howcall = interpret.HowCall.SINGLE
+
+    global_namespace = build_stage_namespace(traversal)
+
     if "code" in traversal.specific_invocation_params:
 
         return {
@@ -39,26 +49,94 @@ def calculate_function(traversal, howcall=None):
                 traversal.specific_invocation_params["code"],
                 global_namespace=global_namespace,
                 howcall=howcall,
+                use_cache=use_cache(traversal),
+                name=traversal.specific_invocation_params.get("label"),
             )
         }
 
     return {"function": None}
 
 
+def calculate_batch_function(traversal):
+    """Build a function over batches of items if the stage asks for batches.
+
+    Code that uses ``await`` is always called once per item.
+    """
+    batch_size = traversal.specific_invocation_params["parameters"].get("batch_size", 1)
+    code = traversal.specific_invocation_params["code"]
+
+    if batch_size <= 1 or interpret.uses_await(code):
+        return {**calculate_function(traversal), "batch_size": 1}
+
+    howcall = traversal.specific_invocation_params.get("howcall")
+    if howcall is None:
+        howcall = interpret.HowCall.SINGLE
+
+    function = interpret.build_batch_function(
+        code,
+        global_namespace=build_stage_namespace(traversal),
+        howcall=howcall,
+        keep_inputs=traversal.plugin_object.name == "filter",
+        use_cache=use_cache(traversal),
+        name=traversal.specific_invocation_params.get("label"),
+    )
+    return {"function": function, "batch_size": batch_size}
+
+
+def _reject_await(traversal):
+    """Raise a usage error if the stage's code awaits."""
+    if interpret.uses_await(traversal.specific_invocation_params["code"]):
+        command = traversal.plugin_object.name.replace("_", "-")
+        raise click.UsageError(f"{command} does not support await")
+
+
+def calculate_thread_function(traversal):
+    _reject_await(traversal)
+    return calculate_function(traversal)
+
+
+def calculate_process_function(traversal):
+    _reject_await(traversal)
+    howcall = traversal.specific_invocation_params.get("howcall")
+    if howcall is None:
+        howcall = interpret.HowCall.SINGLE
+
+    global_options = traversal.global_invocation_options.global_options
+    parameters = traversal.specific_invocation_params["parameters"]
+
+    spec = interpret.FunctionSpec(
+        code=traversal.specific_invocation_params["code"],
+        howcall=howcall,
+        exec_before=(global_options["base_exec_before"], global_options["exec_before"]),
+        inject_values=dict(parameters.get("inject_values", {})),
+        stage_exec_before=parameters.get("exec_before"),
+        use_cache=use_cache(traversal),
+        name=traversal.specific_invocation_params.get("label"),
+    )
+
+    return {
+        "spec": spec,
+        "batch_size": parameters["batch_size"],
+        "processes": parameters["processes"],
+    }
+
+
 def calculate_reduce(traversal):
 
     function = interpret.build_function(
         traversal.specific_invocation_params["code"],
         traversal.global_invocation_options.global_options["global_namespace"],
         howcall=interpret.HowCall.VARARGS,
+        use_cache=use_cache(traversal),
+        name=traversal.specific_invocation_params.get("label"),
     )
 
     return {"function": function}
 
 
-@registry.add_traversal("map", calculate_more_params=calculate_function)
+@registry.add_traversal("map", calculate_more_params=calculate_batch_function)
 async def map(
-    function, items, exit_stack, max_concurrent
+    function, items, exit_stack, max_concurrent, batch_size
 ):  # pylint: disable=redefined-builtin
     """
     Run code on each input item.
@@ -67,6 +145,11 @@ async def map(
     same order. For less strict ordering and asynchronous execution, see
     ``async-map`` and ``async-map-unordered``.
 
+    With ``--batch-size`` greater than 1, code that doesn't use ``await`` is
+    run on a whole batch of items with a single function call, which is much
+    faster for cheap expressions on large inputs. Results are then emitted a
+    batch at a time.
+
     For example,
 
     .. code-block:: bash
@@ -81,13 +164,19 @@ async def map(
         cc
 
     """
+    if batch_size > 1:
+        return await exit_stack.enter_async_context(
+            traversals.sync_batch_map(function, items, batch_size)
+        )
     return await exit_stack.enter_async_context(
         traversals.sync_map(function, items, max_concurrent)
     )
 
 
 @registry.add_traversal("async_map", calculate_more_params=calculate_function)
-async def async_map(function, items, exit_stack, max_concurrent):
+async def async_map(
+    function, items, exit_stack, max_concurrent, max_buffered, stats, trace
+):
     """
     Run code on each input item asynchronously.
 
@@ -118,12 +207,16 @@ async def async_map(function, items, exit_stack, max_concurrent):
 
     """
     return await exit_stack.enter_async_context(
-        traversals.async_map(function, items, max_concurrent)
+        traversals.async_map(
+            function, items, max_concurrent, max_buffered, stats, trace
+        )
     )
 
 
 @registry.add_traversal("async_map_unordered", calculate_more_params=calculate_function)
-async def async_map_unordered(function, items, exit_stack, max_concurrent):
+async def async_map_unordered(
+    function, items, exit_stack, max_concurrent, max_buffered, stats, trace
+):
     """
     Run code on each input item asynchronously, without retaining input order.
 
@@ -155,18 +248,146 @@ async def async_map_unordered(function, items, exit_stack, max_concurrent):
 
     """
     return await exit_stack.enter_async_context(
-        traversals.async_map_unordered(function, items, max_concurrent)
+        traversals.async_map_unordered(
+            function, items, max_concurrent, max_buffered, stats, trace
+        )
     )
 
 
-@registry.add_traversal("filter", calculate_more_params=calculate_function)
+@registry.add_traversal("thread_map", calculate_more_params=calculate_thread_function)
+async def thread_map(
+    function, items, exit_stack, max_concurrent, max_buffered, stats, trace
+):
+    """
+    Run code on each input item in a pool of worker threads.
+
+    Use this for code that makes blocking calls, such as ``subprocess``,
+    ``requests`` or database drivers, without rewriting it to use ``await``. At
+    most ``--max-concurrent`` items are handled at a time. The code cannot use
+    ``await``.
+
+    The order of inputs is retained in the outputs, as with ``async-map``.
+
+    For example,
+
+    .. code-block:: bash
+
+        $ mario thread-map 'os.path.isdir' <<EOF
+        /
+        /not/a/directory
+        EOF
+        True
+        False
+
+    """
+    return await exit_stack.enter_async_context(
+        traversals.thread_map(
+            function, items, max_concurrent, max_buffered, stats=stats, trace=trace
+        )
+    )
+
+
+@registry.add_traversal(
+    "thread_map_unordered", calculate_more_params=calculate_thread_function
+)
+async def thread_map_unordered(
+    function, items, exit_stack, max_concurrent, max_buffered, stats, trace
+):
+    """
+    Run code on each input item in a pool of worker threads, without retaining input order.
+
+    Like ``thread-map``, but each result is emitted as soon as it is ready,
+    regardless of input order.
+
+    For example,
+
+    .. code-block:: bash
+
+        $ mario thread-map-unordered 'time.sleep(float(x)) or x' <<EOF
+        0.2
+        0.1
+        EOF
+        0.1
+        0.2
+
+    """
+    return await exit_stack.enter_async_context(
+        traversals.thread_map(
+            function,
+            items,
+            max_concurrent,
+            max_buffered,
+            ordered=False,
+            stats=stats,
+            trace=trace,
+        )
+    )
+
+
+@registry.add_traversal("process_map", calculate_more_params=calculate_process_function)
+async def process_map(spec, items, exit_stack, batch_size, processes):
+    """
+    Run code on each input item in a pool of worker processes.
+
+    Use this for CPU-bound code, such as parsing or hashing, to make use of all
+    cores. Items are sent to the workers in batches of ``--batch-size``, and
+    the code is rebuilt in each worker from its source, so the code and the
+    ``--exec-before`` namespace must not depend on state created at runtime in
+    the main process. The code cannot use ``await``.
+
+    The order of inputs is retained in the outputs, as with ``async-map``.
+
+    For example,
+
+    .. code-block:: bash
+
+        $ mario process-map 'hashlib.md5(x.encode()).hexdigest()' <<EOF
+        a
+        b
+        EOF
+        0cc175b9c0f1b6a831c399e269772661
+        92eb5ffee6ae2fec3ad71c777531578f
+
+    """
+    return await exit_stack.enter_async_context(
+        traversals.process_map(spec, items, batch_size, processes)
+    )
+
+
+@registry.add_traversal(
+    "process_map_unordered", calculate_more_params=calculate_process_function
+)
+async def process_map_unordered(spec, items, exit_stack, batch_size, processes):
+    """
+    Run code on each input item in a pool of worker processes, without retaining input order.
+
+    Like ``process-map``, but each batch of results is emitted as soon as it is
+    ready, regardless of input order.
+
+    For example,
+
+    .. code-block:: bash
+
+        $ mario process-map-unordered --batch-size 1 'int(x) ** 2' <<EOF
+        3
+        EOF
+        9
+
+    """
+    return await exit_stack.enter_async_context(
+        traversals.process_map(spec, items, batch_size, processes, ordered=False)
+    )
+
+
+@registry.add_traversal("filter", calculate_more_params=calculate_batch_function)
 async def filter(
-    function, items, exit_stack, max_concurrent
+    function, items, exit_stack, max_concurrent, batch_size
 ):  # pylint: disable=redefined-builtin
     """
     Keep input items that satisfy a condition.
 
-    Order of input items is retained in the output.
+    Order of input items is retained in the output. As with ``map``,
+    ``--batch-size`` runs code that doesn't use ``await`` on batches of items.
 
     For example,
 
@@ -185,13 +406,19 @@ async def filter(
         f
     """
 
+    if batch_size > 1:
+        return await exit_stack.enter_async_context(
+            traversals.sync_batch_map(function, items, batch_size)
+        )
     return await exit_stack.enter_async_context(
         traversals.sync_filter(function, items, max_concurrent)
     )
 
 
 @registry.add_traversal("async_filter", calculate_more_params=calculate_function)
-async def async_filter(function, items, exit_stack, max_concurrent):
+async def async_filter(
+    function, items, exit_stack, max_concurrent, max_buffered, stats, trace
+):
     """
     Keep input items that satisfy an asynchronous condition.
 
@@ -211,7 +438,17 @@ async def async_filter(function, items, exit_stack, max_concurrent):
 
     """
     return await exit_stack.enter_async_context(
-        traversals.async_filter(function, items, max_concurrent)
+        traversals.async_filter(
+            function, items, max_concurrent, max_buffered, stats, trace
+        )
+    )
+
+
+@registry.add_traversal("fused")
+async def fused(function, items, exit_stack):
+    """Run consecutive ``map`` and ``filter`` stages combined into one function."""
+    return await exit_stack.enter_async_context(
+        traversals.sync_filter_map(function, items, interpret.SKIP)
     )
 
 
@@ -313,6 +550,102 @@ async def chain(items, exit_stack):
     return await exit_stack.enter_async_context(traversals.sync_chain(items))
 
 
+def calculate_csv_params(traversal):
+    parameters = traversal.specific_invocation_params["parameters"]
+    return {"dialect": parameters["dialect"], "as_dicts": parameters["dicts"]}
+
+
+@registry.add_traversal("read_csv", calculate_more_params=calculate_csv_params)
+async def read_csv(items, exit_stack, dialect, as_dicts):
+    """
+    Parse csv records from input lines as they arrive.
+
+    Quoted fields may contain newlines. With ``--dicts``, the first row holds
+    the field names and each following row is a dict. Otherwise each row is a
+    tuple.
+
+    This is used by ``read-csv-dicts`` and ``read-csv-tuples``.
+    """
+    return await exit_stack.enter_async_context(
+        traversals.read_csv(items, as_dicts, dialect=dialect)
+    )
+
+
+@registry.add_traversal("read_json_array")
+async def read_json_array(items, exit_stack):
+    """
+    Decode the elements of a json array from input lines as they arrive.
+
+    Each element is emitted as soon as its closing bracket is read, so the
+    whole array is never held in memory.
+
+    This is used by ``read-json-array``.
+    """
+    return await exit_stack.enter_async_context(traversals.read_json_array(items))
+
+
+def calculate_xml_params(traversal):
+    parameters = traversal.specific_invocation_params["parameters"]
+    return {
+        "record_path": parameters["record_path"],
+        "process_namespaces": parameters["process_namespaces"],
+    }
+
+
+@registry.add_traversal("read_xml", calculate_more_params=calculate_xml_params)
+async def read_xml(items, exit_stack, record_path, process_namespaces):
+    """
+    Parse xml from input lines as they arrive.
+
+    With ``--record-path``, e.g. ``/feed/entry``, each element at that path is
+    emitted as a dict as soon as it is closed, so large documents are read in
+    constant memory. Otherwise the whole document is emitted as one dict.
+
+    This is used by ``read-xml``.
+    """
+    return await exit_stack.enter_async_context(
+        traversals.read_xml(
+            items,
+            record_path,
+            process_namespaces=process_namespaces,
+            dict_constructor=dict,
+        )
+    )
+
+
+@registry.add_traversal("read_yaml_documents")
+async def read_yaml_documents(items, exit_stack):
+    """
+    Load the documents of a yaml stream as they arrive.
+
+    Documents are separated by ``---`` lines. Each document is emitted as
+    soon as the next one starts, so the stream is never held in memory.
+
+    This is used by ``read-yaml-docs``.
+    """
+    return await exit_stack.enter_async_context(traversals.read_yaml_documents(items))
+
+
+def calculate_read_all_params(traversal):
+    parameters = traversal.specific_invocation_params["parameters"]
+    return {"sep": parameters["sep"], "as_bytes": parameters["bytes"]}
+
+
+@registry.add_traversal("read_all", calculate_more_params=calculate_read_all_params)
+async def read_all(items, exit_stack, sep, as_bytes):
+    """
+    Read the whole input into one string, joining lines with ``--sep``.
+
+    When this is the first stage, the input is read in large chunks, or memory
+    mapped if it is a regular file, instead of being split into lines first.
+
+    This is used by ``read-text`` and ``read-bytes``.
+    """
+    return await exit_stack.enter_async_context(
+        traversals.read_all(items, sep, as_bytes)
+    )
+
+
 subcommands = [
     cli_tools.DocumentedCommand(
         "map",
@@ -358,6 +691,36 @@ subcommands = [
     ),
 ]
 
+thread_subcommands = [
+    cli_tools.DocumentedCommand(
+        "thread-map",
+        help=thread_map.__doc__,
+        short_help="Call code on each line of input in worker threads.",
+        section="Parallel traversals",
+    ),
+    cli_tools.DocumentedCommand(
+        "thread-map-unordered",
+        help=thread_map_unordered.__doc__,
+        short_help="Call code on each line of input in worker threads, ignoring order of input items.",
+        section="Parallel traversals",
+    ),
+]
+
+process_subcommands = [
+    cli_tools.DocumentedCommand(
+        "process-map",
+        help=process_map.__doc__,
+        short_help="Call code on each line of input in worker processes.",
+        section="Parallel traversals",
+    ),
+    cli_tools.DocumentedCommand(
+        "process-map-unordered",
+        help=process_map_unordered.__doc__,
+        short_help="Call code on each line of input in worker processes, ignoring order of input items.",
+        section="Parallel traversals",
+    ),
+]
+
 
 def build_callback(sub_command):
     def callback(code, autocall, **parameters):
@@ -382,7 +745,7 @@ option_exec_before = click.option(
     "--exec-before", help="Execute code in the function's global namespace."
 )
 
-for subcommand in subcommands:
+for subcommand in subcommands + thread_subcommands + process_subcommands:
 
     subcommand.params = [
         click.Option(
@@ -401,6 +764,37 @@ for subcommand in subcommands:
     registry.add_cli(name=subcommand.name)(subcommand)
 
 
+for subcommand in subcommands:
+    if subcommand.name in ["map", "filter"]:
+        subcommand.params.insert(
+            0,
+            click.Option(
+                ["--batch-size"],
+                type=int,
+                default=1,
+                help="Number of items passed to the code at a time, "
+                "if the code doesn't use await.",
+            ),
+        )
+
+
+for subcommand in process_subcommands:
+    subcommand.params[:0] = [
+        click.Option(
+            ["--batch-size"],
+            type=int,
+            default=1000,
+            help="Number of items sent to a worker process at a time.",
+        ),
+        click.Option(
+            ["--processes"],
+            type=int,
+            default=None,
+            help="Number of worker processes. Defaults to the number of CPUs.",
+        ),
+    ]
+
+
 @registry.add_cli(name="reduce")
 @click.command(  # type: ignore
     "reduce",
@@ -442,6 +836,82 @@ for cmd in more_commands:
     registry.add_cli(name=cmd.name)(cmd)
 
 
+@registry.add_cli(name="read-csv")
+@click.command(
+    "read-csv",
+    cls=cli_tools.DocumentedCommand,
+    section="Read",
+    hidden=True,
+    short_help="Parse csv records from input lines as they arrive.",
+    help=read_csv.__doc__,
+)
+@click.option(
+    "--dialect",
+    type=click.Choice(["excel", "excel-tab", "unix"]),
+    default="excel",
+    help="CSV dialect (See https://docs.python.org/3/library/csv.html)",
+)
+@click.option("--dicts", is_flag=True, help="Read rows into dicts.")
+def _read_csv(**parameters):
+    return [{"name": "read_csv", "parameters": parameters}]
+
+
+@registry.add_cli(name="read-json-elements")
+@click.command(
+    "read-json-elements",
+    cls=cli_tools.DocumentedCommand,
+    section="Read",
+    hidden=True,
+    short_help="Decode the elements of a json array as they arrive.",
+    help=read_json_array.__doc__,
+)
+def _read_json_elements(**parameters):
+    return [{"name": "read_json_array", "parameters": parameters}]
+
+
+@registry.add_cli(name="read-xml-records")
+@click.command(
+    "read-xml-records",
+    cls=cli_tools.DocumentedCommand,
+    section="Read",
+    hidden=True,
+    short_help="Parse xml records as they arrive.",
+    help=read_xml.__doc__,
+)
+@click.option("--record-path", default="", help="Path of the elements to emit.")
+@click.option("--process-namespaces", is_flag=True, help="Expand namespaces.")
+def _read_xml_records(**parameters):
+    return [{"name": "read_xml", "parameters": parameters}]
+
+
+@registry.add_cli(name="read-yaml-stream")
+@click.command(
+    "read-yaml-stream",
+    cls=cli_tools.DocumentedCommand,
+    section="Read",
+    hidden=True,
+    short_help="Load the documents of a yaml stream as they arrive.",
+    help=read_yaml_documents.__doc__,
+)
+def _read_yaml_stream(**parameters):
+    return [{"name": "read_yaml_documents", "parameters": parameters}]
+
+
+@registry.add_cli(name="read-all")
+@click.command(
+    "read-all",
+    cls=cli_tools.DocumentedCommand,
+    section="Read",
+    hidden=True,
+    short_help="Read the whole input into one string.",
+    help=read_all.__doc__,
+)
+@click.option("--sep", default="\n", help="Separator to join input lines with")
+@click.option("--bytes", is_flag=True, help="Read bytes instead of a string.")
+def _read_all(**parameters):
+    return [{"name": "read_all", "parameters": parameters}]
+
+
 meta = click.Group("meta", chain=True)
 meta.section = doc.UNSECTIONED  # type: ignore
 meta.sections = None  # type: ignore
@@ -493,7 +963,7 @@ def run_tests(ctx, pytest_args):
 
     import mario.app
 
-    COMMANDS = mario.app.global_registry.commands.values()  # pylint: disable=no-member
+    COMMANDS = mario.app.get_global_registry().commands.values()
     TEST_SPECS = [test for command in COMMANDS for test in command.tests]
 
 
@@ -517,3 +987,40 @@ def run_tests(ctx, pytest_args):
 
 
 registry.add_cli(name="meta")(meta)
+
+
+@registry.add_cli(name="serve")
+@click.command(
+    "serve",
+    cls=cli_tools.DocumentedCommand,
+    section=doc.UNSECTIONED,
+    short_help="Keep mario running to answer commands from mario-client.",
+)
+@click.option(
+    "--socket",
+    "socket_path",
+    default=None,
+    help="Path of the Unix socket. Defaults to $MARIO_SOCKET or a per-user file in the temporary directory.",
+)
+@click.pass_context
+def serve(ctx, socket_path):
+    """
+    Keep mario running to answer commands from ``mario-client``.
+
+    ``mario-client`` (or ``python -m mario.client``) takes the same arguments
+    as ``mario``. It sends them and its stdin to the server and prints the
+    results, which avoids starting Python and loading plugins on every call. If
+    no server is running, ``mario-client`` runs ``mario`` directly.
+
+    Each command gets its own global namespace. Commands run in the client's
+    working directory but see the server's environment variables, and output
+    written directly to ``sys.stdout``, e.g. with ``print``, goes to the
+    server. ``--profile``, ``--loop-stats`` and ``--loop-stats-file`` measure
+    the whole server, so the server rejects them.
+    """
+    # pylint: disable=import-outside-toplevel
+    from mario import client
+    from mario import server
+
+    server.main(socket_path or client.default_socket_path())
+    ctx.exit()
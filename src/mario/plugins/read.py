@@ -18,3 +18,11 @@ def read_csv_dicts(file, **kwargs) -> t.Iterable[t.Mapping[t.Any, str]]:
 def read_csv_tuples(file, **kwargs) -> t.Iterable[t.Tuple]:
     """Read csv rows into an iterable of tuples."""
     return (tuple(row) for row in csv.reader(file, **kwargs))
+
+
+def load_yaml(text: str) -> t.Any:
+    """Load a yaml document, with libyaml if it is available."""
+    # pylint: disable=import-outside-toplevel
+    import yaml
+
+    return yaml.load(text, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
@@ -7,8 +7,6 @@ import io
 import itertools
 import typing as t
 
-import yaml
-
 
 def write_csv_dicts(rows: t.Iterable[t.Dict], header: bool, dialect: str) -> str:
     """Write iterable of dicts to csv."""
@@ -37,6 +35,9 @@ def write_csv_tuples(rows: t.Iterable[t.Tuple], dialect: str) -> str:
 
 def write_yaml(data) -> str:
     """Write data to yaml string."""
+    # pylint: disable=import-outside-toplevel
+    import yaml
+
     file = io.StringIO()
-    yaml.dump(data, file)
+    yaml.dump(data, file, Dumper=getattr(yaml, "CDumper", yaml.Dumper))
     return file.getvalue()
@@ -0,0 +1,278 @@
+"""Run mario invocations from :mod:`mario.client` in one long-lived process."""
+
+from __future__ import generator_stop
+
+import contextlib
+import io
+import json
+import os
+import signal
+import socket
+import traceback
+
+import async_generator
+import click
+import trio
+
+from . import app
+from . import client
+
+
+# Options that measure the whole process, which the server shares between requests.
+PROCESS_OPTIONS = {
+    "profile": "--profile",
+    "loop_stats": "--loop-stats",
+    "loop_stats_file": "--loop-stats-file",
+}
+
+
+class FramedReceiveStream(trio.abc.ReceiveStream):
+    """The client's stdin, read from ``i`` frames until a ``c`` frame."""
+
+    def __init__(self, connection: "Connection"):
+        self._connection = connection
+        self._closed = False
+
+    async def receive_some(self, max_bytes=None):
+        if self._closed:
+            return b""
+        tag, payload = await self._connection.receive_frame()
+        if tag == client.INPUT_CLOSED:
+            self._closed = True
+            return b""
+        if tag != client.INPUT:
+            raise trio.BrokenResourceError(f"unexpected frame {tag!r}")
+        return payload
+
+    async def aclose(self):
+        self._closed = True
+
+
+class FramedSendStream(trio.abc.SendStream):
+    """Writes data to the client in frames tagged with ``tag``."""
+
+    def __init__(self, connection: "Connection", tag: bytes):
+        self._connection = connection
+        self._tag = tag
+
+    async def send_all(self, data):
+        await self._connection.send_frame(self._tag, data)
+
+    async def wait_send_all_might_not_block(self):
+        await self._connection.stream.wait_send_all_might_not_block()
+
+    async def aclose(self):
+        pass
+
+
+class Connection:
+    """A client connection using the protocol described in :mod:`mario.client`."""
+
+    def __init__(self, stream: trio.abc.Stream):
+        self.stream = stream
+        self._buffer = bytearray()
+        self._send_lock = trio.Lock()
+
+    async def _receive_exactly(self, size):
+        while len(self._buffer) < size:
+            data = await self.stream.receive_some(client.READ_SIZE)
+            if not data:
+                raise trio.BrokenResourceError("client closed the connection")
+            self._buffer += data
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    async def receive_frame(self):
+        header = await self._receive_exactly(client.HEADER.size)
+        tag, size = client.HEADER.unpack(header)
+        return tag, await self._receive_exactly(size)
+
+    async def send_frame(self, tag, payload=b""):
+        async with self._send_lock:
+            await self.stream.send_all(client.encode_frame(tag, payload))
+
+
+class WorkingDirectory:
+    """Share the process working directory between concurrent requests.
+
+    Requests from the same directory run concurrently. A request from another
+    directory waits until the running requests have finished.
+    """
+
+    def __init__(self):
+        self._path = None
+        self._users = 0
+        self._changed = trio.Condition()
+
+    @async_generator.asynccontextmanager
+    async def use(self, path):
+        async with self._changed:
+            while self._users and self._path != path:
+                await self._changed.wait()
+            if self._path != path:
+                os.chdir(path)
+                self._path = path
+            self._users += 1
+        try:
+            yield
+        finally:
+            with trio.CancelScope(shield=True):
+                async with self._changed:
+                    self._users -= 1
+                    self._changed.notify_all()
+
+
+def parse_command_line(argv):
+    """Run the command line parser and collect what it prints.
+
+    Returns the exit status, the captured stdout and stderr, and the pipeline
+    to run as ``(pairs, options)``, or ``None`` if there is nothing to run.
+    """
+    # pylint: disable=import-outside-toplevel
+    from . import cli
+
+    obj = {}
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    # Parsing never awaits, so no other request sees the redirected streams.
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            result = cli.cli.main(
+                args=argv, prog_name="mario", standalone_mode=False, obj=obj
+            )
+            status = result if isinstance(result, int) else 0
+        except click.ClickException as e:
+            e.show()
+            status = e.exit_code
+        except click.Abort:
+            click.echo("Aborted!", err=True)
+            status = 1
+        except SystemExit as e:
+            status = e.code or 0
+
+    return status, stdout.getvalue(), stderr.getvalue(), obj.get("pipeline")
+
+
+async def run_request(connection, working_directory):
+    tag, payload = await connection.receive_frame()
+    if tag != client.ARGUMENTS:
+        raise trio.BrokenResourceError(f"unexpected frame {tag!r}")
+    arguments = json.loads(payload)
+    argv = arguments["argv"]
+    if argv[:1] == ["serve"]:
+        await connection.send_frame(client.ERROR, b"mario is already serving.\n")
+        return 1
+
+    status, stdout, stderr, pipeline = parse_command_line(argv)
+    if stdout:
+        await connection.send_frame(client.OUTPUT, stdout.encode())
+    if stderr:
+        await connection.send_frame(client.ERROR, stderr.encode())
+    if pipeline is None or status:
+        return status
+
+    pairs, options = pipeline
+    unsupported = [
+        flag
+        for name, flag in PROCESS_OPTIONS.items()
+        if options.get(name) not in (None, False)
+    ]
+    if unsupported:
+        message = (
+            f"Error: {', '.join(unsupported)} cannot be used with mario serve, "
+            "which shares its process between requests. Run mario without the "
+            "server to use them.\n"
+        )
+        await connection.send_frame(client.ERROR, message.encode())
+        return 2
+
+    stats_file = io.StringIO()
+    try:
+        async with working_directory.use(arguments["cwd"]):
+            await app.async_main(
+                pairs,
+                input_stream=FramedReceiveStream(connection),
+                output_stream=FramedSendStream(connection, client.OUTPUT),
+                stats_file=stats_file,
+                **options,
+            )
+    finally:
+        if stats_file.getvalue():
+            await connection.send_frame(client.ERROR, stats_file.getvalue().encode())
+    return 0
+
+
+async def handle_connection(stream, working_directory):
+    async with stream:
+        connection = Connection(stream)
+        try:
+            try:
+                status = await run_request(connection, working_directory)
+            except (trio.BrokenResourceError, trio.ClosedResourceError):
+                raise
+            except click.ClickException as e:
+                # Raised while the stages are set up, e.g. for unsupported code.
+                message = f"Error: {e.format_message()}\n"
+                await connection.send_frame(client.ERROR, message.encode())
+                status = e.exit_code
+            except Exception:  # pylint: disable=broad-except
+                # Report the error to the client and keep serving.
+                message = traceback.format_exc()
+                await connection.send_frame(client.ERROR, message.encode())
+                status = 1
+            await connection.send_frame(client.EXIT, str(status).encode())
+        except (trio.BrokenResourceError, trio.ClosedResourceError):
+            pass
+
+
+async def open_listener(path):
+    try:
+        client.connect(path).close()
+    except OSError:
+        # Nothing is listening, so any file left at ``path`` is stale.
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+    else:
+        raise click.ClickException(f"mario is already serving on {path}")
+
+    sock = trio.socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o077)
+    try:
+        await sock.bind(path)
+    finally:
+        os.umask(umask)
+    sock.listen()
+    return trio.SocketListener(sock)
+
+
+async def serve(path, task_status=trio.TASK_STATUS_IGNORED):
+    """Serve requests on the Unix socket at ``path`` until cancelled."""
+    listener = await open_listener(path)
+    working_directory = WorkingDirectory()
+
+    async def handler(stream):
+        await handle_connection(stream, working_directory)
+
+    try:
+        await trio.serve_listeners(handler, [listener], task_status=task_status)
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+
+
+async def serve_until_terminated(path):
+    """Serve on ``path`` until SIGTERM, removing the socket on the way out."""
+    with trio.open_signal_receiver(signal.SIGTERM) as signals:
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(serve, path)
+            async for _ in signals:
+                nursery.cancel_scope.cancel()
+                break
+
+
+def main(path):
+    try:
+        trio.run(serve_until_terminated, path)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,45 @@
+"""Declarative command definitions, as loaded by :mod:`mario.declarative`.
+
+These classes don't depend on marshmallow, so loading a pickled command only
+needs click and pyrsistent.
+"""
+
+import typing as t
+
+import attr
+import click
+import pyrsistent
+
+
+@attr.dataclass(frozen=True)
+class RemapParam:
+    new: str
+    old: str
+
+
+@attr.dataclass(frozen=True)
+class CommandStage:
+    command: str
+    remap_params: t.List[RemapParam] = attr.ib(converter=pyrsistent.freeze)
+    params: t.Dict[str, str] = attr.ib(converter=pyrsistent.freeze)
+
+
+@attr.dataclass(frozen=True)
+class CommandTest:
+    invocation: t.List[str] = attr.ib(converter=pyrsistent.freeze)
+    input: str
+    output: str
+
+
+@attr.dataclass(frozen=True)
+class CommandSpec:
+    name: str
+    short_help: t.Optional[str]
+    help: t.Optional[str]
+    arguments: t.List[click.Argument] = attr.ib(converter=pyrsistent.freeze)
+    options: t.List[click.Option] = attr.ib(converter=pyrsistent.freeze)
+    stages: t.List[CommandStage] = attr.ib(converter=pyrsistent.freeze)
+    inject_values: t.List[str] = attr.ib(converter=pyrsistent.freeze)
+    tests: t.List[CommandTest] = attr.ib(converter=pyrsistent.freeze)
+    section: str
+    hidden: bool
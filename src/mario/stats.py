@@ -0,0 +1,176 @@
+"""Per-stage throughput and latency statistics for ``mario --stats``.
+
+Each stage's output is wrapped in a :class:`Meter`, which counts the items and
+the time the next stage spends waiting for them. For stages that run in the
+same task as their consumer, the time spent in the stage itself is that time
+less the time the stage spent waiting for its own input. Async traversals also
+report the time each call of the user function takes and how many items were
+in flight at once. Latency percentiles are estimated from a fixed-size random
+sample, so memory stays bounded on long streams.
+"""
+
+import array
+import json
+import random
+import time
+import typing as t
+
+import attr
+
+from . import asynch
+
+
+LATENCY_SAMPLE_SIZE = 4096
+
+
+@attr.dataclass
+class StageStats:
+    label: str
+    items: int = 0
+    # Time the consumer of the stage waited for its items.
+    wait_time: float = 0.0
+    # Time the stage waited for items from the previous stage.
+    upstream_time: float = 0.0
+    start: float = None
+    end: float = None
+    # A uniform sample of at most LATENCY_SAMPLE_SIZE latencies.
+    latencies: array.array = attr.ib(factory=lambda: array.array("d"))
+    latency_count: int = 0
+    latency_total: float = 0.0
+    in_flight: int = 0
+    peak_in_flight: int = 0
+
+    def task_started(self) -> None:
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def task_finished(self) -> None:
+        self.in_flight -= 1
+
+    def record_latency(self, seconds: float) -> None:
+        self.latency_count += 1
+        self.latency_total += seconds
+        if len(self.latencies) < LATENCY_SAMPLE_SIZE:
+            self.latencies.append(seconds)
+            return
+        # Reservoir sampling: every latency so far is kept with equal chance.
+        index = random.randrange(self.latency_count)
+        if index < LATENCY_SAMPLE_SIZE:
+            self.latencies[index] = seconds
+
+    @property
+    def busy_time(self) -> float:
+        """Time spent running the stage's code."""
+        if self.latency_count:
+            return self.latency_total
+        return max(0.0, self.wait_time - self.upstream_time)
+
+    def percentiles(self, *fractions: float) -> t.List[t.Optional[float]]:
+        if not self.latencies:
+            return [None for _ in fractions]
+        ordered = sorted(self.latencies)
+        last = len(ordered) - 1
+        return [ordered[min(last, int(f * len(ordered)))] for f in fractions]
+
+    def to_dict(self) -> dict:
+        duration = (self.end or 0.0) - (self.start or 0.0)
+        p50, p95, p99 = self.percentiles(0.50, 0.95, 0.99)
+        return {
+            "stage": self.label,
+            "items": self.items,
+            "seconds": duration,
+            "items_per_second": self.items / duration if duration > 0 else None,
+            "busy_seconds": self.busy_time,
+            "upstream_seconds": self.upstream_time,
+            "latency_p50": p50,
+            "latency_p95": p95,
+            "latency_p99": p99,
+            "peak_in_flight": self.peak_in_flight if self.latencies else None,
+        }
+
+
+class Meter:
+    """Count the items of ``items`` and time how long each takes to arrive.
+
+    ``producer`` is the stage the items come from and ``consumer`` the stage
+    that reads them, if any. Batched iterables stay batched.
+    """
+
+    def __init__(self, items, producer: StageStats, consumer: StageStats = None):
+        self._items = items
+        self._producer = producer
+        self._consumer = consumer
+
+    def metered(self):
+        if isinstance(self._items, asynch.Batched):
+            return asynch.Batched(self._measure(self._items.batches, len))
+        return self._measure(self._items, lambda item: 1)
+
+    async def _measure(self, iterable, count):
+        producer = self._producer
+        consumer = self._consumer
+        iterator = iterable.__aiter__()
+        producer.start = time.perf_counter()
+        while True:
+            before = time.perf_counter()
+            try:
+                value = await iterator.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                after = time.perf_counter()
+                producer.wait_time += after - before
+                producer.end = after
+                if consumer is not None:
+                    consumer.upstream_time += after - before
+            producer.items += count(value)
+            yield value
+
+
+def _format_milliseconds(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.2f}"
+
+
+def format_table(stages: t.List[StageStats]) -> str:
+    rows = [
+        (
+            "stage",
+            "items",
+            "items/s",
+            "busy s",
+            "upstream s",
+            "p50 ms",
+            "p95 ms",
+            "p99 ms",
+            "peak",
+        )
+    ]
+    for stage in stages:
+        d = stage.to_dict()
+        rate = d["items_per_second"]
+        rows.append(
+            (
+                d["stage"],
+                str(d["items"]),
+                "-" if rate is None else f"{rate:.0f}",
+                f"{d['busy_seconds']:.3f}",
+                f"{d['upstream_seconds']:.3f}",
+                _format_milliseconds(d["latency_p50"]),
+                _format_milliseconds(d["latency_p95"]),
+                _format_milliseconds(d["latency_p99"]),
+                "-" if d["peak_in_flight"] is None else str(d["peak_in_flight"]),
+            )
+        )
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = []
+    for row in rows:
+        cells = [row[0].ljust(widths[0])]
+        cells += [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]
+        lines.append("  ".join(cells).rstrip())
+    return "\n".join(lines) + "\n"
+
+
+def write_json(stages: t.List[StageStats], path: str) -> None:
+    with open(path, "w") as f:
+        json.dump([stage.to_dict() for stage in stages], f, indent=2)
+        f.write("\n")
@@ -0,0 +1,86 @@
+"""Per-item spans of async traversals for ``mario --trace``.
+
+The spans are written as Chrome trace events, which can be opened in
+``chrome://tracing`` or https://ui.perfetto.dev. Each item of a stage is shown
+as an async track with one span per phase, e.g. waiting for the concurrency
+limit, running the user function, waiting for the previous item so output
+keeps its order, and waiting for the next stage to take the result.
+
+Only the most recent spans are kept, so tracing long runs uses bounded memory.
+"""
+
+import collections
+import itertools
+import json
+import os
+import time
+
+
+MAX_SPANS = 2 ** 20
+
+
+class Tracer:
+    """Collect spans in a ring buffer of at most ``max_spans`` spans."""
+
+    def __init__(self, max_spans: int = MAX_SPANS):
+        self.spans = collections.deque(maxlen=max_spans)
+        self.recorded = 0
+        self.start = time.perf_counter()
+
+    def stage(self, label: str) -> "StageTracer":
+        return StageTracer(self, label)
+
+    def add(self, name, label, item_id, start, end):
+        self.spans.append((name, label, item_id, start, end))
+        self.recorded += 1
+
+    def to_json(self) -> dict:
+        pid = os.getpid()
+        events = []
+        for name, label, item_id, start, end in self.spans:
+            common = {"name": name, "cat": label, "id": item_id, "pid": pid, "tid": 0}
+            events.append({**common, "ph": "b", "ts": self._microseconds(start)})
+            events.append({**common, "ph": "e", "ts": self._microseconds(end)})
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {"dropped_spans": self.recorded - len(self.spans)},
+        }
+
+    def _microseconds(self, timestamp):
+        return round((timestamp - self.start) * 1e6, 3)
+
+    def write(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.to_json(), f)
+
+
+class StageTracer:
+    """Trace the items of the stage ``label``."""
+
+    def __init__(self, tracer: Tracer, label: str):
+        self.tracer = tracer
+        self.label = label
+        self._ids = itertools.count()
+
+    def start_item(self) -> "ItemSpans":
+        return ItemSpans(self, next(self._ids))
+
+
+class ItemSpans:
+    """Record consecutive spans of one item.
+
+    Each call of :meth:`mark` ends a span that started at the previous mark.
+    """
+
+    __slots__ = ["stage", "item_id", "last"]
+
+    def __init__(self, stage: StageTracer, item_id: int):
+        self.stage = stage
+        self.item_id = item_id
+        self.last = time.perf_counter()
+
+    def mark(self, name: str) -> None:
+        now = time.perf_counter()
+        self.stage.tracer.add(name, self.stage.label, self.item_id, self.last, now)
+        self.last = now
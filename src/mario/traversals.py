@@ -1,7 +1,15 @@
 from __future__ import annotations
 from __future__ import generator_stop
 
+import collections
+import concurrent.futures
+import csv
+import functools
 import itertools
+import json
+import os
+import re
+import time
 import types
 import typing as t
 from typing import AsyncIterable
@@ -13,6 +21,8 @@ from typing import Iterable
 import async_generator
 import trio
 
+from . import asynch
+
 
 T = t.TypeVar("T")
 U = t.TypeVar("U")
@@ -31,6 +41,23 @@ async def aenumerate(items, start=0):
         i += 1
 
 
+async def abatch(items, size):
+    if isinstance(items, asynch.Batched):
+        async for batch in items.batches:
+            for start in range(0, len(batch), size):
+                yield batch[start : start + size]
+        return
+
+    batch = []
+    async for x in items:
+        batch.append(x)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 class AsyncIterableWrapper:
     def __init__(self, iterable):
         self.iterable = iter(iterable)
@@ -45,30 +72,97 @@ class AsyncIterableWrapper:
             raise StopAsyncIteration
 
 
+class _UnboundedWindow:
+    async def acquire(self):
+        pass
+
+    def release(self):
+        pass
+
+
+def _make_window(max_buffered):
+    """Limit the number of items that have been started but not yet emitted.
+
+    Input is only consumed while the window has room, so slow items at the head
+    of the line apply backpressure instead of letting pending tasks pile up.
+    """
+    if max_buffered is None:
+        return _UnboundedWindow()
+    return trio.Semaphore(max_buffered)
+
+
+def _task_name(function):
+    """Name the tasks that call ``function`` after its stage, if it has a name.
+
+    Otherwise Trio names them after the function they run.
+    """
+    return getattr(function, "name", None)
+
+
+async def _timed_call(function, item, stats):
+    start = time.perf_counter()
+    try:
+        return await function(item)
+    finally:
+        stats.record_latency(time.perf_counter() - start)
+
+
 @async_generator.asynccontextmanager
 async def async_map(
-    function: Callable[[T], Awaitable[U]], iterable: AsyncIterable[T], max_concurrent
+    function: Callable[[T], Awaitable[U]],
+    iterable: AsyncIterable[T],
+    max_concurrent,
+    max_buffered=None,
+    stats=None,
+    trace=None,
 ) -> AsyncIterator[AsyncIterable[U]]:
+    """Map ``function`` over ``iterable`` concurrently, keeping the input order.
+
+    If ``stats`` is given, it is told when each item starts and finishes, and
+    how long each call of ``function`` takes, see :class:`mario.stats.StageStats`.
+    If ``trace`` is given, the phases of each item are recorded as spans, see
+    :class:`mario.tracing.StageTracer`.
+    """
     # pylint: disable=unsubscriptable-object
     send_result, receive_result = trio.open_memory_channel[U](0)
     limiter = trio.CapacityLimiter(max_concurrent)
+    window = _make_window(max_buffered)
+    task_name = _task_name(function)
 
     async def wrapper(prev_done: trio.Event, self_done: trio.Event, item: T) -> None:
+        if stats is not None:
+            stats.task_started()
+        spans = None if trace is None else trace.start_item()
 
         # pylint: disable=not-async-context-manager
         async with limiter:
-            result = await function(item)
+            if spans is not None:
+                spans.mark("wait for limiter")
+            if stats is None:
+                result = await function(item)
+            else:
+                result = await _timed_call(function, item, stats)
+            if spans is not None:
+                spans.mark("call")
 
         await prev_done.wait()
+        if spans is not None:
+            spans.mark("wait for previous item")
         await send_result.send(result)
+        if spans is not None:
+            spans.mark("send")
         self_done.set()
+        window.release()
+        if stats is not None:
+            stats.task_finished()
 
     async def consume_input(nursery) -> None:
         prev_done = trio.Event()
         prev_done.set()
         async for item in iterable:
+            await window.acquire()
             self_done = trio.Event()
-            nursery.start_soon(wrapper, prev_done, self_done, item)
+            nursery.start_soon(wrapper, prev_done, self_done, item, name=task_name)
             prev_done = self_done
         await prev_done.wait()
         await send_result.aclose()
@@ -79,13 +173,56 @@ async def async_map(
         nursery.cancel_scope.cancel()
 
 
+def plain_callable(function):
+    """Get a callable that runs ``function`` without awaiting, if it has one.
+
+    Functions built from code without ``await`` expose the plain function as
+    ``wrapped``, which avoids creating and awaiting a coroutine per item.
+    Returns ``None`` for async functions.
+    """
+    if getattr(function, "is_async", True):
+        return None
+    return getattr(function, "wrapped", function)
+
+
 @async_generator.asynccontextmanager
 async def sync_map(
     function: Callable[[T], Awaitable[U]],
     iterable: AsyncIterable[T],
     max_concurrent,  # pylint: disable=unused-argument
 ) -> AsyncIterator[AsyncIterable[U]]:
-    yield (await function(item) async for item in iterable)
+    call = plain_callable(function)
+    if call is None:
+        yield (await function(item) async for item in iterable)
+    else:
+        yield (call(item) async for item in iterable)
+
+
+@async_generator.asynccontextmanager
+async def sync_batch_map(
+    function: Callable[[t.List[T]], t.List[U]],
+    iterable: AsyncIterable[T],
+    batch_size: int,
+) -> AsyncIterator[AsyncIterable[U]]:
+    """Map a synchronous function over batches of items, returning batches."""
+    call = getattr(function, "wrapped", function)
+    yield asynch.Batched(call(batch) async for batch in abatch(iterable, batch_size))
+
+
+@async_generator.asynccontextmanager
+async def sync_filter_map(
+    function: Callable[[T], U], iterable: AsyncIterable[T], skip
+) -> AsyncIterator[AsyncIterable[U]]:
+    """Map a synchronous function over items, dropping results that are ``skip``."""
+    call = getattr(function, "wrapped", function)
+
+    async def filter_map():
+        async for item in iterable:
+            result = call(item)
+            if result is not skip:
+                yield result
+
+    yield filter_map()
 
 
 @async_generator.asynccontextmanager
@@ -93,42 +230,426 @@ async def sync_chain(iterable: AsyncIterable[Iterable], **_kwargs):
     yield (item async for subiterable in iterable for item in subiterable)
 
 
+def _join_frames(view, terminator: bytes, sep: str, encoding: t.Optional[str]):
+    if view[-len(terminator) :] == terminator:
+        view = view[: -len(terminator)]
+    if encoding is None:
+        data = bytes(view)
+        if sep != terminator.decode():
+            data = data.replace(terminator, sep.encode())
+        return data
+    text = str(view, encoding)
+    if sep != terminator.decode(encoding):
+        text = text.replace(terminator.decode(encoding), sep)
+    return text
+
+
+@async_generator.asynccontextmanager
+async def read_all(
+    iterable: AsyncIterable[str], sep: str = "\n", as_bytes: bool = False
+) -> AsyncIterator[AsyncIterable]:
+    """Join all input lines with ``sep`` into one string, or bytes.
+
+    When ``iterable`` is the program's input, the input is received whole
+    instead of being split into lines, decoded and joined again.
+    """
+    receiver = iterable.batches if isinstance(iterable, asynch.Batched) else None
+
+    async def whole():
+        if isinstance(
+            receiver,
+            (asynch.TerminatedFrameBatchReceiver, asynch.MappedFrameBatchReceiver),
+        ):
+            encoding = None if as_bytes else receiver.encoding
+            yield await receiver.receive_rest(
+                functools.partial(
+                    _join_frames,
+                    terminator=receiver.terminator,
+                    sep=sep,
+                    encoding=encoding,
+                )
+            )
+            return
+        text = sep.join([line async for line in iterable])
+        yield text.encode() if as_bytes else text
+
+    yield whole()
+
+
+class _NeedMoreLines(Exception):
+    pass
+
+
+class _CsvLines:
+    """Lines for a ``csv.reader`` to pull from as input arrives.
+
+    When no line is available, the reader is interrupted with
+    :class:`_NeedMoreLines`. The lines of a record that was interrupted are
+    remembered so the record can be parsed again once more lines arrive.
+    """
+
+    def __init__(self):
+        self.pending = collections.deque()
+        self.record = []
+        self.finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.pending:
+            line = self.pending.popleft()
+            self.record.append(line)
+            return line
+        if self.finished:
+            raise StopIteration
+        raise _NeedMoreLines()
+
+    def read_rows(self, reader):
+        """Return the rows that can be parsed from the pending lines."""
+        rows = []
+        while True:
+            try:
+                row = next(reader)
+            except _NeedMoreLines:
+                self.pending.extendleft(reversed(self.record))
+                self.record.clear()
+                return rows
+            except StopIteration:
+                return rows
+            self.record.clear()
+            rows.append(row)
+
+
+def _csv_tuples(rows):
+    return [tuple(row) for row in rows]
+
+
+class _CsvDicts:
+    """Convert rows to dicts keyed by the first row, like ``csv.DictReader``."""
+
+    def __init__(self):
+        self.fieldnames = None
+
+    def __call__(self, rows):
+        dicts = []
+        for row in rows:
+            if self.fieldnames is None:
+                self.fieldnames = row
+                continue
+            if not row:
+                continue
+            d = dict(zip(self.fieldnames, row))
+            if len(row) > len(self.fieldnames):
+                d[None] = row[len(self.fieldnames) :]
+            else:
+                for key in self.fieldnames[len(row) :]:
+                    d[key] = None
+            dicts.append(d)
+        return dicts
+
+
+async def _line_batches(items):
+    if isinstance(items, asynch.Batched):
+        async for batch in items.batches:
+            yield batch
+    else:
+        async for item in items:
+            yield [item]
+
+
+@async_generator.asynccontextmanager
+async def read_csv(
+    iterable: AsyncIterable[str], as_dicts=False, **fmtparams
+) -> AsyncIterator[AsyncIterable]:
+    """Parse csv records from input lines as they arrive.
+
+    Quoted fields may contain newlines. Only the lines of the current record
+    are kept. With ``as_dicts``, the first row holds the field names and each
+    following row is a dict, like ``csv.DictReader``.
+    """
+    lines = _CsvLines()
+    reader = csv.reader(lines, **fmtparams)
+    convert = _CsvDicts() if as_dicts else _csv_tuples
+
+    async def rows():
+        async for batch in _line_batches(iterable):
+            lines.pending.extend(line + "\n" for line in batch)
+            yield convert(lines.read_rows(reader))
+        lines.finished = True
+        yield convert(lines.read_rows(reader))
+
+    yield asynch.Batched(rows())
+
+
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class _JsonArrayDecoder:
+    """Decode the elements of a json array from text as it arrives.
+
+    Only the text of the element being decoded is kept. An element that is
+    not complete yet is decoded again once the buffer has doubled, so large
+    elements that arrive in many small pieces take linear time.
+    """
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        # One of "start", "first", "value", "separator" and "end".
+        self.state = "start"
+        self.retry_size = 0
+
+    def feed(self, text: str) -> list:
+        self.buffer += text
+        if len(self.buffer) < self.retry_size:
+            return []
+        return self._decode(final=False)
+
+    def close(self) -> list:
+        elements = self._decode(final=True)
+        if self.state != "end":
+            raise json.JSONDecodeError(
+                "Unterminated json array", self.buffer, len(self.buffer)
+            )
+        return elements
+
+    def _decode(self, final):
+        elements = []
+        buffer = self.buffer
+        pos = 0
+        while True:
+            pos = _JSON_WHITESPACE.match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+            char = buffer[pos]
+            if self.state == "start":
+                if char != "[":
+                    raise json.JSONDecodeError("Expecting '['", buffer, pos)
+                self.state = "first"
+                pos += 1
+            elif self.state == "separator" or (self.state == "first" and char == "]"):
+                if char == "]":
+                    self.state = "end"
+                elif char == ",":
+                    self.state = "value"
+                else:
+                    raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+                pos += 1
+            elif self.state == "end":
+                raise json.JSONDecodeError("Extra data", buffer, pos)
+            else:
+                try:
+                    element, pos = self.decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if final:
+                        raise
+                    break
+                elements.append(element)
+                self.state = "separator"
+        self.buffer = buffer[pos:]
+        self.retry_size = 2 * len(self.buffer)
+        return elements
+
+
+@async_generator.asynccontextmanager
+async def read_json_array(iterable: AsyncIterable[str]) -> AsyncIterator[AsyncIterable]:
+    """Decode the elements of a json array from input lines as they arrive.
+
+    Each element is emitted as soon as it is complete, so memory is bounded by
+    the largest element rather than the whole array.
+    """
+    decoder = _JsonArrayDecoder()
+
+    async def elements():
+        async for batch in _line_batches(iterable):
+            yield decoder.feed("".join(line + "\n" for line in batch))
+        yield decoder.close()
+
+    yield asynch.Batched(elements())
+
+
+@async_generator.asynccontextmanager
+async def _parse_in_thread(
+    iterable: AsyncIterable[str], parse: Callable
+) -> AsyncIterator[AsyncIterable]:
+    """Run a blocking parser over input lines as they arrive.
+
+    ``parse(chunks, emit)`` runs in a worker thread. ``chunks`` is an iterator
+    of the input as utf-8 encoded chunks of lines, and ``emit`` is called with
+    each parsed item. Items are passed back to the event loop in batches, each
+    time the parser asks for the next chunk.
+    """
+    send_batch, receive_batch = trio.open_memory_channel(0)
+    send_items, receive_items = trio.open_memory_channel(0)
+    items: list = []
+
+    async def feed():
+        async with send_batch:
+            async for batch in _line_batches(iterable):
+                await send_batch.send(batch)
+
+    def send_items_from_thread():
+        if items:
+            trio.from_thread.run(send_items.send, items.copy())
+            items.clear()
+
+    def chunks():
+        while True:
+            send_items_from_thread()
+            try:
+                batch = trio.from_thread.run(receive_batch.receive)
+            except trio.EndOfChannel:
+                return
+            if batch:
+                yield "".join(line + "\n" for line in batch).encode()
+
+    def run_parser():
+        parse(chunks(), items.append)
+        send_items_from_thread()
+
+    async def run():
+        try:
+            await trio.to_thread.run_sync(run_parser, cancellable=True)
+        finally:
+            # Closing wakes the consumer, which cancels the nursery when it is
+            # done. Shield the close so a parse error is not replaced by that
+            # cancellation.
+            with trio.CancelScope(shield=True):
+                await send_items.aclose()
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(feed)
+        nursery.start_soon(run)
+        yield asynch.Batched(receive_items)
+        nursery.cancel_scope.cancel()
+
+
+class _ChunkFile:
+    """A file whose ``read`` returns the next of ``chunks``, whatever its size."""
+
+    def __init__(self, chunks: t.Iterator[bytes]):
+        self.chunks = chunks
+
+    def read(self, size: int = -1) -> bytes:
+        return next(self.chunks, b"")
+
+
+@async_generator.asynccontextmanager
+async def read_xml(
+    iterable: AsyncIterable[str], record_path: str = "", **xmltodict_kwargs
+) -> AsyncIterator[AsyncIterable]:
+    """Parse xml from input lines as they arrive with ``xmltodict``.
+
+    ``record_path`` is a path of element names like ``/feed/entry``. Each
+    element at that path is emitted as it is closed and then discarded, so
+    memory is bounded by the largest record. Without ``record_path``, the
+    whole document is emitted as one item.
+    """
+    import xmltodict  # pylint: disable=import-outside-toplevel
+
+    names = [name for name in record_path.split("/") if name]
+
+    def parse(chunks, emit):
+        def collect(path, item):
+            if [name for name, _attributes in path] == names:
+                emit(item)
+            return True
+
+        document = xmltodict.parse(
+            _ChunkFile(chunks),
+            item_depth=len(names),
+            item_callback=collect,
+            **xmltodict_kwargs,
+        )
+        if not names:
+            emit(document)
+
+    async with _parse_in_thread(iterable, parse) as records:
+        yield records
+
+
+@async_generator.asynccontextmanager
+async def read_yaml_documents(
+    iterable: AsyncIterable[str],
+) -> AsyncIterator[AsyncIterable]:
+    """Load the documents of a yaml stream from input lines as they arrive.
+
+    Each document is emitted once the next one starts or the input ends. The
+    libyaml loader is used if it is available.
+    """
+    import yaml  # pylint: disable=import-outside-toplevel
+
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+    def parse(chunks, emit):
+        for document in yaml.load_all(_ChunkFile(chunks), Loader=loader):
+            emit(document)
+
+    async with _parse_in_thread(iterable, parse) as documents:
+        yield documents
+
+
 @async_generator.asynccontextmanager
 async def sync_filter(
     function: Callable,
     iterable: AsyncIterable,
     max_concurrent,  # pylint: disable=unused-argument
 ) -> AsyncIterator[AsyncIterable[U]]:
-    yield (item async for item in iterable if await function(item))
+    call = plain_callable(function)
+    if call is None:
+        yield (item async for item in iterable if await function(item))
+    else:
+        yield (item async for item in iterable if call(item))
 
 
 @async_generator.asynccontextmanager
 async def async_map_unordered(
-    function: Callable[[T], Awaitable[U]], iterable: AsyncIterable[T], max_concurrent
+    function: Callable[[T], Awaitable[U]],
+    iterable: AsyncIterable[T],
+    max_concurrent,
+    max_buffered=None,
+    stats=None,
+    trace=None,
 ) -> AsyncIterator[AsyncIterable[U]]:
     # pylint: disable=unsubscriptable-object
     send_result, receive_result = trio.open_memory_channel[U](0)
     limiter = trio.CapacityLimiter(max_concurrent)
-    remaining_tasks: t.Set[int] = set()
-
-    async def wrapper(task_id: int, item: T) -> None:
-        # pylint: disable=not-async-context-manager
-        async with limiter:
-            result = await function(item)
-
-        await send_result.send(result)
-        remaining_tasks.remove(task_id)
+    window = _make_window(max_buffered)
+    task_name = _task_name(function)
+
+    # Every task owns a clone of the send channel, so the receiving side sees
+    # the end of the channel once the input is exhausted and the last task has
+    # sent its result. Nothing needs to poll for completion.
+    async def wrapper(task_send_result: trio.MemorySendChannel, item: T) -> None:
+        if stats is not None:
+            stats.task_started()
+        spans = None if trace is None else trace.start_item()
+
+        async with task_send_result:
+            # pylint: disable=not-async-context-manager
+            async with limiter:
+                if spans is not None:
+                    spans.mark("wait for limiter")
+                if stats is None:
+                    result = await function(item)
+                else:
+                    result = await _timed_call(function, item, stats)
+                if spans is not None:
+                    spans.mark("call")
+
+            await task_send_result.send(result)
+            if spans is not None:
+                spans.mark("send")
+        window.release()
+        if stats is not None:
+            stats.task_finished()
 
     async def consume_input(nursery) -> None:
-
-        async for task_id, item in aenumerate(iterable):
-            remaining_tasks.add(task_id)
-            nursery.start_soon(wrapper, task_id, item)
-
-        while remaining_tasks:
-            await trio.sleep(0)
-
-        await send_result.aclose()
+        async with send_result:
+            async for item in iterable:
+                await window.acquire()
+                nursery.start_soon(wrapper, send_result.clone(), item, name=task_name)
 
     async with trio.open_nursery() as nursery:
         nursery.start_soon(consume_input, nursery)
@@ -138,29 +659,55 @@ async def async_map_unordered(
 
 @async_generator.asynccontextmanager
 async def async_filter(
-    function: Callable[[T], Awaitable[T]], iterable: AsyncIterable[T], max_concurrent
+    function: Callable[[T], Awaitable[T]],
+    iterable: AsyncIterable[T],
+    max_concurrent,
+    max_buffered=None,
+    stats=None,
+    trace=None,
 ) -> AsyncIterator[AsyncIterable[T]]:
     # pylint: disable=unsubscriptable-object
     send_result, receive_result = trio.open_memory_channel[T](0)
 
     limiter = trio.CapacityLimiter(max_concurrent)
+    window = _make_window(max_buffered)
+    task_name = _task_name(function)
 
     async def wrapper(prev_done: trio.Event, self_done: trio.Event, item: T) -> None:
+        if stats is not None:
+            stats.task_started()
+        spans = None if trace is None else trace.start_item()
+
         # pylint: disable=not-async-context-manager
         async with limiter:
-            result = await function(item)
+            if spans is not None:
+                spans.mark("wait for limiter")
+            if stats is None:
+                result = await function(item)
+            else:
+                result = await _timed_call(function, item, stats)
+            if spans is not None:
+                spans.mark("call")
 
         await prev_done.wait()
+        if spans is not None:
+            spans.mark("wait for previous item")
         if result:
             await send_result.send(item)
+            if spans is not None:
+                spans.mark("send")
         self_done.set()
+        window.release()
+        if stats is not None:
+            stats.task_finished()
 
     async def consume_input(nursery) -> None:
         prev_done = trio.Event()
         prev_done.set()
         async for item in iterable:
+            await window.acquire()
             self_done = trio.Event()
-            nursery.start_soon(wrapper, prev_done, self_done, item)
+            nursery.start_soon(wrapper, prev_done, self_done, item, name=task_name)
             prev_done = self_done
         await prev_done.wait()
         await send_result.aclose()
@@ -184,6 +731,7 @@ async def async_reduce(
     # pylint: disable=unsubscriptable-object
     send_result, receive_result = trio.open_memory_channel[U](0)
     limiter = trio.CapacityLimiter(max_concurrent)
+    task_name = _task_name(function)
 
     collected_result = initializer
 
@@ -209,7 +757,7 @@ async def async_reduce(
         prev_done.set()
         async for item in iterable:
             self_done = trio.Event()
-            nursery.start_soon(wrapper, prev_done, self_done, item)
+            nursery.start_soon(wrapper, prev_done, self_done, item, name=task_name)
             prev_done = self_done
         await prev_done.wait()
         await send_result.send(collected_result)
@@ -225,3 +773,105 @@ async def wait_for(x):
     if isinstance(x, types.CoroutineType):
         return await x
     return x
+
+
+def resolve_sync(x):
+    """Get the result of ``x`` without an event loop.
+
+    Coroutines are driven to completion, which only works if they never
+    suspend. Other values are returned unchanged.
+    """
+    if not isinstance(x, types.CoroutineType):
+        return x
+    try:
+        x.send(None)
+    except StopIteration as e:
+        return e.value
+    x.close()
+    raise RuntimeError("Code run outside the event loop cannot use await.")
+
+
+def _call_sync(function, item):
+    return resolve_sync(function(item))
+
+
+@async_generator.asynccontextmanager
+async def thread_map(
+    function: Callable,
+    iterable: AsyncIterable,
+    max_concurrent,
+    max_buffered=None,
+    ordered=True,
+    stats=None,
+    trace=None,
+) -> AsyncIterator[AsyncIterable]:
+    """Map over ``iterable``, calling ``function`` in worker threads.
+
+    At most ``max_concurrent`` threads run ``function`` at a time.
+    """
+    limiter = trio.CapacityLimiter(max_concurrent)
+
+    call = plain_callable(function) or function
+
+    async def run_in_thread(item):
+        return await trio.to_thread.run_sync(_call_sync, call, item, limiter=limiter)
+
+    mapper = async_map if ordered else async_map_unordered
+    async with mapper(
+        run_in_thread, iterable, max_concurrent, max_buffered, stats, trace
+    ) as results:
+        yield results
+
+
+_process_function = None
+
+
+def _init_process_worker(spec):
+    global _process_function  # pylint: disable=global-statement
+    function = spec.build()
+    _process_function = plain_callable(function) or function
+
+
+def _run_process_batch(batch):
+    return [resolve_sync(_process_function(item)) for item in batch]
+
+
+@async_generator.asynccontextmanager
+async def process_map(
+    spec, iterable: AsyncIterable, batch_size: int, processes=None, ordered=True
+) -> AsyncIterator[AsyncIterable]:
+    """Map over ``iterable`` in a pool of worker processes.
+
+    Each worker rebuilds the function once from ``spec`` and then handles
+    batches of ``batch_size`` items. Two batches per worker are kept in flight
+    so no worker waits for the event loop between batches, and at most four
+    per worker are read ahead of the output.
+
+    The threads waiting for batches have their own limiter rather than Trio's
+    default one. When the map is cancelled, batches that have not started are
+    dropped and the pool is shut down without blocking the event loop.
+    """
+    processes = processes or os.cpu_count() or 1
+    limiter = trio.CapacityLimiter(2 * processes)
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=processes, initializer=_init_process_worker, initargs=(spec,)
+    )
+
+    async def run_batch(batch):
+        future = executor.submit(_run_process_batch, batch)
+        try:
+            return await trio.to_thread.run_sync(
+                future.result, cancellable=True, limiter=limiter
+            )
+        finally:
+            future.cancel()
+
+    try:
+        mapper = async_map if ordered else async_map_unordered
+        async with mapper(
+            run_batch, abatch(iterable, batch_size), 2 * processes, 4 * processes
+        ) as batches:
+            yield (item async for batch in batches for item in batch)
+    finally:
+        with trio.CancelScope(shield=True):
+            await trio.to_thread.run_sync(executor.shutdown)
@@ -9,6 +9,11 @@ def _runner():
     return click.testing.CliRunner()
 
 
+@pytest.fixture(autouse=True)
+def _tmp_cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("MARIO_CACHE_DIR", str(tmp_path / "cache"))
+
+
 @pytest.fixture(name="tmp_env")
 def _tmp_env(tmp_path):
     env = os.environ.copy()
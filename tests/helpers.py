@@ -1,5 +1,6 @@
 import os
 import pathlib
+import resource
 import subprocess
 import sys
 import time
@@ -18,6 +19,12 @@ def run(args, capture_output=True, check=True, **kwargs):
     return proc.stdout
 
 
+async def aiter_list(items):
+    """Yield ``items`` from an async iterator."""
+    for item in items:
+        yield item
+
+
 @attr.s(auto_exc=True)
 class TimerMaxExceeded(mario.exceptions.MarioException):
     """Raised if the timer max is exceeded."""
@@ -60,3 +67,41 @@ class Timer:
         if self.elapsed > self.max:
             if not int(os.environ.get("MARIO_TESTING_IGNORE_TIMER", 0)):
                 raise TimerMaxExceeded(self)
+
+
+@attr.s
+class ChildCpuTimer:
+    """Measure the CPU time used by child processes in the body of the context manager.
+
+    Args:
+        max (float): Maximum allowed CPU seconds. An exception will be raised if
+                     the children used more than this when the context manager
+                     exits.
+        elapsed (float): Total CPU seconds (user and system) used by children
+                         that exited during the body. Set to ``None`` until the
+                         context manager exits.
+
+    Raises:
+        TimerMaxExceeded: If the maximum is exceeded when the context manager
+                          exits.
+    """
+
+    max = attr.ib(default=float("inf"))
+    elapsed = attr.ib(default=None)
+    _start = attr.ib(default=None)
+
+    @staticmethod
+    def _cpu_time():
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return usage.ru_utime + usage.ru_stime
+
+    def __enter__(self):
+        self._start = self._cpu_time()
+        return self
+
+    def __exit__(self, *args):
+        self.elapsed = self._cpu_time() - self._start
+
+        if self.elapsed > self.max:
+            if not int(os.environ.get("MARIO_TESTING_IGNORE_TIMER", 0)):
+                raise TimerMaxExceeded(self)
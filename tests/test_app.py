@@ -4,6 +4,7 @@
 from __future__ import generator_stop
 
 import os
+import pstats
 import subprocess
 import sys
 import textwrap
@@ -175,3 +176,122 @@ def test_meta_test_command_pass(tmp_path, tmp_env):
         check=False,
     )
     assert proc.returncode == 0
+
+
+def test_process_map():
+    args = ["--exec-before", "k = 10", "process-map", "--batch-size", "2", "int(x)*k"]
+    output = helpers.run(args, input=b"1\n2\n3\n4\n5\n").decode()
+    assert output == "10\n20\n30\n40\n50\n"
+
+
+def test_process_map_unordered():
+    args = ["process-map-unordered", "--batch-size", "1", "x * 2"]
+    output = helpers.run(args, input=b"a\nb\nc\n").decode()
+    assert sorted(output.splitlines()) == ["aa", "bb", "cc"]
+
+
+def test_thread_map_keeps_order():
+    args = ["--max-concurrent", "3", "thread-map", "time.sleep(float(x)) or x"]
+    output = helpers.run(args, input=b"0.6\n0.2\n0.4\n").decode()
+    assert output == "0.6\n0.2\n0.4\n"
+
+
+def test_thread_map_unordered():
+    args = [
+        "--max-concurrent",
+        "3",
+        "thread-map-unordered",
+        "time.sleep(float(x)) or x",
+    ]
+    output = helpers.run(args, input=b"0.6\n0.2\n0.4\n").decode()
+    assert output == "0.2\n0.4\n0.6\n"
+
+
+def test_map_batch_size():
+    args = ["map", "--batch-size", "2", "str.upper ! x + '!'"]
+    output = helpers.run(args, input=b"a\nb\nc\n").decode()
+    assert output == "A!\nB!\nC!\n"
+
+
+def test_filter_batch_size():
+    args = ["filter", "--batch-size", "2", "len(x) > 1"]
+    output = helpers.run(args, input=b"a\nbb\nccc\n").decode()
+    assert output == "bb\nccc\n"
+
+
+def test_fused_stages_keep_their_own_namespaces():
+    args = [
+        "--exec-before",
+        "suffix = '!'",
+        "map",
+        "str.strip",
+        "filter",
+        "x",
+        "map",
+        "--exec-before",
+        "suffix = '?'",
+        "x + suffix",
+        "map",
+        "x + suffix",
+    ]
+    output = helpers.run(args, input=b" a\n\n b\n").decode()
+    assert output == "a?!\nb?!\n"
+
+
+def test_profile_names_functions_after_stages(tmp_path):
+    profile_path = tmp_path / "stats"
+    args = ["--profile", str(profile_path), "map", "int", "filter", "x > 1"]
+    output = helpers.run(args, input=b"1\n2\n").decode()
+    assert output == "2\n"
+
+    stats = pstats.Stats(str(profile_path))
+    filenames = {filename for filename, _, _ in stats.stats}
+    assert "<stage 1: map 'int'>" in filenames
+    assert "<stage 2: filter 'x > 1'>" in filenames
+
+
+def test_traceback_names_the_stage():
+    proc = subprocess.run(
+        [sys.executable, "-m", "mario", "map", "1 / int(x)"],
+        input=b"0\n",
+        capture_output=True,
+    )
+    assert proc.returncode != 0
+    stderr = proc.stderr.decode()
+    assert "File \"<stage 1: map '1 / int(x)'>\", line 2" in stderr
+    assert "x = 1 / int(x)" in stderr
+
+
+def test_closed_output_ends_quietly(tmp_path):
+    input_path = tmp_path / "input.txt"
+    input_path.write_text("".join(f"{i}\n" for i in range(100_000)))
+    with input_path.open() as stdin:
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "mario", "map", "x"],
+            stdin=stdin,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+    assert proc.stdout.readline() == b"0\n"
+    proc.stdout.close()
+    assert proc.wait(timeout=60) == 0
+    assert proc.stderr.read() == b""
+
+
+def test_print_in_stage_keeps_its_place_in_output():
+    output = helpers.run(["map", 'print("p", x) or x'], input=b"1\n2\n3\n").decode()
+    assert output == "p 1\n1\np 2\n2\np 3\n3\n"
+
+
+@pytest.mark.parametrize(
+    "command",
+    ["process-map", "process-map-unordered", "thread-map", "thread-map-unordered"],
+)
+def test_pool_maps_reject_await(command):
+    proc = subprocess.run(
+        [sys.executable, "-m", "mario", command, "await trio.sleep(0) or x"],
+        input=b"1\n",
+        capture_output=True,
+    )
+    assert proc.returncode == 2
+    assert f"{command} does not support await".encode() in proc.stderr
@@ -1,5 +1,6 @@
 # pylint: disable=unused-argument
 
+import os
 import subprocess
 import sys
 import textwrap
@@ -7,6 +8,10 @@ import time
 
 import pytest
 import requests
+import trio
+
+import mario.asynch
+import mario.exceptions
 
 from . import helpers
 
@@ -159,3 +164,217 @@ def test_async_filter():
     """
     )
     assert result == expected
+
+
+def test_async_map_max_buffered():
+    """Input is not read further ahead of the output than ``--max-buffered``."""
+    args = [
+        "--max-concurrent",
+        "2",
+        "--max-buffered",
+        "3",
+        "--exec-before",
+        "started = []",
+        "async-map",
+        "[started.append(x), await trio.sleep(float(x)), len(started)][-1]",
+    ]
+    stdin = b"1\n" + b"0\n" * 9
+
+    output = helpers.run(args, input=stdin).decode()
+
+    assert output.splitlines()[0] == "3"
+
+
+def test_async_map_default_max_buffered_follows_max_concurrent():
+    """The default window never limits ``--max-concurrent``."""
+    args = [
+        "--max-concurrent",
+        "1200",
+        "--exec-before",
+        "started = []",
+        "async-map",
+        "[started.append(x), await trio.sleep(float(x)), len(started)][-1]",
+    ]
+    stdin = b"1\n" + b"0\n" * 1500
+
+    output = helpers.run(args, input=stdin).decode()
+
+    assert output.splitlines()[0] == "1200"
+
+
+def test_max_buffered_below_max_concurrent_is_rejected():
+    args = ["--max-concurrent", "3", "--max-buffered", "2", "async-map", "x"]
+    proc = subprocess.run(
+        [sys.executable, "-m", "mario", *args], input=b"1\n", capture_output=True
+    )
+    assert proc.returncode == 2
+    assert b"--max-buffered must be at least --max-concurrent" in proc.stderr
+
+
+class ChunkStream:
+    """A receive stream that returns the given chunks, then end of file."""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    async def receive_some(self, max_bytes):  # pylint: disable=unused-argument
+        if self.chunks:
+            return self.chunks.pop(0)
+        return b""
+
+
+def receive_all_batches(receiver):
+    async def main():
+        return [batch async for batch in receiver]
+
+    return trio.run(main)
+
+
+def test_batch_receiver_splits_frames_across_chunks():
+    stream = ChunkStream([b"a\nb", b"c\nd\n", b"\xc3", b"\xa9\n"])
+    receiver = mario.asynch.TerminatedFrameBatchReceiver(
+        stream, b"\n", encoding="utf-8"
+    )
+
+    assert receive_all_batches(receiver) == [["a"], ["bc", "d"], ["é"]]
+
+
+def test_batch_receiver_rejects_long_frame():
+    stream = ChunkStream([b"a\n" + b"b" * 10 + b"\nc\n"])
+    receiver = mario.asynch.TerminatedFrameBatchReceiver(
+        stream, b"\n", max_frame_length=5
+    )
+
+    with pytest.raises(ValueError):
+        receive_all_batches(receiver)
+
+
+def test_batch_receiver_rejects_incomplete_frame():
+    stream = ChunkStream([b"a\nb"])
+    receiver = mario.asynch.TerminatedFrameBatchReceiver(stream, b"\n")
+
+    with pytest.raises(mario.exceptions.IncompleteFrameError):
+        receive_all_batches(receiver)
+
+
+def test_batch_receiver_receive_rest_after_frames():
+    stream = ChunkStream([b"a\nb", b"c\n"])
+    receiver = mario.asynch.TerminatedFrameBatchReceiver(stream, b"\n")
+
+    async def main():
+        return await receiver.receive(), await receiver.receive_rest(bytes)
+
+    assert trio.run(main) == ([b"a"], b"bc\n")
+
+
+def open_receiver(path, skip=0, **kwargs):
+    with open(path, "rb") as f:
+        os.read(f.fileno(), skip)
+        return mario.asynch.open_frame_batch_receiver(f.fileno(), b"\n", **kwargs)
+
+
+def test_open_frame_batch_receiver_maps_regular_files(tmp_path):
+    path = tmp_path / "input.txt"
+    path.write_bytes(b"a\nb\nc\xc3\xa9\n")
+
+    receiver = open_receiver(path, skip=2, encoding="utf-8")
+    assert isinstance(receiver, mario.asynch.MappedFrameBatchReceiver)
+    receiver.receive_size = receiver.max_frame_length = 3
+    assert receive_all_batches(receiver) == [["b"], ["cé"]]
+
+    receiver = open_receiver(path, skip=2)
+
+    async def main():
+        return await receiver.receive(), await receiver.receive_rest(bytes)
+
+    assert trio.run(main) == ([b"b", b"c\xc3\xa9"], b"")
+
+
+def test_open_frame_batch_receiver_streams_pipes_and_empty_files(tmp_path):
+    path = tmp_path / "input.txt"
+    path.write_bytes(b"")
+    receiver = open_receiver(path)
+    assert isinstance(receiver, mario.asynch.TerminatedFrameBatchReceiver)
+
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, b"a\n")
+    os.close(write_fd)
+    receiver = mario.asynch.open_frame_batch_receiver(read_fd, b"\n")
+    os.close(read_fd)
+    assert isinstance(receiver, mario.asynch.TerminatedFrameBatchReceiver)
+    assert receive_all_batches(receiver) == [[b"a"]]
+
+
+@pytest.mark.parametrize(
+    "data, error",
+    [
+        (b"a\nb", mario.exceptions.IncompleteFrameError),
+        (b"a\n" + b"b" * 10 + b"\nc\n", ValueError),
+    ],
+)
+def test_mapped_receiver_rejects_bad_frames(tmp_path, data, error):
+    path = tmp_path / "input.txt"
+    path.write_bytes(data)
+    receiver = open_receiver(path)
+    receiver.max_frame_length = 5
+
+    with pytest.raises(error):
+        receive_all_batches(receiver)
+
+
+def test_read_text_from_regular_file(tmp_path):
+    path = tmp_path / "input.txt"
+    path.write_text("a\nb\n")
+
+    with open(path) as f:
+        assert helpers.run(["read-text", "--sep", ","], stdin=f) == b"a,b\n"
+    with open(path) as f:
+        assert helpers.run(["read-bytes"], stdin=f) == b"b'a\\nb'\n"
+
+
+class RecordingStream:
+    """A send stream that records each write."""
+
+    def __init__(self):
+        self.writes = []
+
+    async def send_all(self, data):
+        self.writes.append(data)
+
+
+def test_send_lines_writes_in_bulk():
+    stream = RecordingStream()
+    items = mario.asynch.Batched(helpers.aiter_list([[1, 2], [], [3], ["é"]]))
+    trio.run(mario.asynch.send_lines, stream, items, 4)
+
+    assert stream.writes == [b"1\n2\n", b"3\n\xc3\xa9\n"]
+
+
+def test_send_lines_accepts_plain_async_iterables():
+    stream = RecordingStream()
+    trio.run(mario.asynch.send_lines, stream, helpers.aiter_list(["a", "b"]))
+
+    assert stream.writes == [b"a\nb\n"]
+
+
+class SlowStream(RecordingStream):
+    """A send stream that takes a while to write."""
+
+    async def send_all(self, data):
+        await trio.sleep(0.05)
+        await super().send_all(data)
+
+
+async def slow_batches(batches):
+    for batch in batches:
+        yield batch
+        await trio.sleep(0.02)
+
+
+def test_send_lines_finishes_periodic_flush():
+    stream = SlowStream()
+    items = mario.asynch.Batched(slow_batches([[0, 1]]))
+    # The input ends while the periodic flush is still writing.
+    trio.run(mario.asynch.send_lines, stream, items, 2 ** 16, 0.01)
+
+    assert stream.writes == [b"0\n1\n"]
@@ -0,0 +1,25 @@
+import os
+
+from mario import cache
+
+
+def test_store_and_load():
+    key = cache.make_key("function", "(x)", "x + 1")
+    assert cache.load(key) is None
+
+    cache.store(key, ("source", (1, 2), True))
+    assert cache.load(key) == ("source", (1, 2), True)
+
+
+def test_store_evicts_least_recently_used():
+    keys = [cache.make_key(str(i)) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.store(key, b"x" * 100)
+        os.utime(cache.get_cache_dir() / key, (i, i))
+
+    cache.store(cache.make_key("new"), b"x" * 100, max_size=250)
+
+    assert cache.load(keys[0]) is None
+    assert cache.load(keys[1]) is None
+    assert cache.load(keys[2]) == b"x" * 100
+    assert cache.load(cache.make_key("new")) == b"x" * 100
@@ -47,6 +47,20 @@ def test_config_jsonl_command(tmp_path):
     )
 
 
+def test_config_command_changes_are_picked_up(tmp_path):
+    config_file_path = tmp_path / "config.toml"
+    config_body = (helpers.TESTS_DIR / "data/config/jsonl_command.toml").read_text()
+    env = dict(os.environ)
+    env.update({f"{utils.NAME}_CONFIG_DIR".upper(): str(tmp_path)})
+    stdin = b'{"a": 1}\n'
+
+    config_file_path.write_text(config_body)
+    assert helpers.run(["jsonl"], input=stdin, env=env) == b"{'a': 1}\n"
+
+    config_file_path.write_text(config_body.replace("json.loads", "len"))
+    assert helpers.run(["jsonl"], input=stdin, env=env) == b"8\n"
+
+
 def test_m_namespace(tmp_path, tmp_env):
     """The init file is available under the ``m`` namespace."""
     file = tmp_path / "m" / "__init__.py"
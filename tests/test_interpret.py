@@ -1,5 +1,7 @@
 import collections
+import linecache
 import os.path
+import sys
 import urllib.parse
 
 import lxml.etree
@@ -22,15 +24,109 @@ def test_split_pipestring():
     "name, expected",
     [
         ("str.upper", {}),
-        ("os.path.join", {"os": os, "os.path": os.path}),
+        ("os.path.join", {"os": os}),
         ("map", {}),
         ("collections.Counter", {"collections": collections}),
-        ("urllib.parse.urlparse", {"urllib": urllib, "urllib.parse": urllib.parse}),
-        ("lxml.etree.parse", {"lxml": lxml, "lxml.etree": lxml.etree}),
+        ("urllib.parse.urlparse", {"urllib": urllib}),
+        ("lxml.etree.parse", {"lxml": lxml}),
     ],
 )
 def test_get_module(name, expected):
-    assert interpret.build_name_to_module(name) == expected
+    name_to_module = interpret.build_name_to_module(name)
+    assert {k: sys.modules[v.__name__] for k, v in name_to_module.items()} == expected
+
+
+def test_autoimport_imports_submodules(monkeypatch):
+    monkeypatch.delitem(sys.modules, "xml.dom.minidom", raising=False)
+    name_to_module = interpret.build_name_to_module("xml.dom.minidom.parseString")
+    assert name_to_module["xml"].dom.minidom.parseString
+
+
+@pytest.mark.parametrize(
+    "code, expected",
+    [
+        ("x.strip().split", []),
+        ("os.path.join(x, sep.join)", ["os.path.join", "sep.join"]),
+        ("[y.upper() for y in x if re.match]", ["re.match"]),
+        ("lambda y: y.strip + json.dumps(x)", ["json.dumps"]),
+        ("(y := x.split()) and y.pop", []),
+        ("x.attr(collections.Counter)", ["collections.Counter"]),
+    ],
+)
+def test_find_maybe_module_names(code, expected):
+    assert interpret.find_maybe_module_names(code) == expected
+
+
+def test_find_maybe_module_names_excludes_defined_names():
+    assert interpret.find_maybe_module_names("sep.join(x)", ["sep"]) == []
+
+
+def test_missing_modules_are_remembered(monkeypatch):
+    monkeypatch.setattr(interpret, "MISSING_MODULES", interpret.MissingModules())
+    imported = []
+    find_spec = interpret.importlib.util.find_spec
+
+    def counting_find_spec(name):
+        imported.append(name)
+        return find_spec(name)
+
+    monkeypatch.setattr(interpret.importlib.util, "find_spec", counting_find_spec)
+    assert interpret.build_name_to_module("nosuchmodule.thing") == {}
+    assert imported
+
+    imported.clear()
+    monkeypatch.setattr(interpret, "MISSING_MODULES", interpret.MissingModules())
+    assert interpret.build_name_to_module("nosuchmodule.thing") == {}
+    assert imported == []
+
+
+def test_missing_modules_are_forgotten_when_sys_path_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(interpret, "MISSING_MODULES", interpret.MissingModules())
+    monkeypatch.syspath_prepend(str(tmp_path))
+    for use_cache in [True, False]:
+        name = f"mario_test_added_module_{use_cache}"
+        assert interpret.build_name_to_module(f"{name}.f", use_cache=use_cache) == {}
+
+        (tmp_path / f"{name}.py").write_text("f = str\n")
+        os.utime(tmp_path, ns=(0, 1 + use_cache))
+        name_to_module = interpret.build_name_to_module(
+            f"{name}.f", use_cache=use_cache
+        )
+        assert list(name_to_module) == [name]
+
+
+def test_autoimports_are_lazy(monkeypatch):
+    monkeypatch.delitem(sys.modules, "colorsys", raising=False)
+    name_to_module = interpret.build_name_to_module("colorsys.rgb_to_hsv")
+    assert isinstance(name_to_module["colorsys"], interpret.LazyModule)
+    assert "colorsys" not in sys.modules
+
+    assert name_to_module["colorsys"].rgb_to_hsv(1, 0, 0) == (0, 1, 1)
+    assert "colorsys" in sys.modules
+
+
+def test_lazy_module_imports_submodules():
+    module = interpret.LazyModule("urllib", ["urllib.parse.quote"])
+    assert module.parse is urllib.parse
+    with pytest.raises(AttributeError):
+        module.nosuchattribute  # pylint: disable=pointless-statement
+
+
+def test_exec_before_imports_are_lazy(monkeypatch):
+    monkeypatch.delitem(sys.modules, "colorsys", raising=False)
+    source = "import colorsys\nimport os.path as p\nfrom json import dumps\n"
+    namespace = interpret.build_global_namespace(source)
+    assert isinstance(namespace["colorsys"], interpret.LazyModule)
+    assert "colorsys" not in sys.modules
+    assert namespace["p"] is os.path
+    assert namespace["dumps"].__name__ == "dumps"
+
+    assert namespace["colorsys"].hsv_to_rgb(0, 0, 1) == (1, 1, 1)
+
+
+def test_exec_before_missing_import_fails():
+    with pytest.raises(ModuleNotFoundError):
+        interpret.build_global_namespace("import nosuchmodule")
 
 
 @pytest.mark.parametrize(
@@ -71,3 +167,100 @@ def test_autocall_in_eval():
 def test_autocall_requires_symbol():
     output = helpers.run(["map", "pathlib.Path(x).name"], input=b"a\nbb\n").decode()
     assert output == "a\nbb\n"
+
+
+@pytest.mark.parametrize(
+    "code, expected",
+    [
+        ("x.upper()", False),
+        ("await asks.get(x)", True),
+        ("str.strip ! await f(x)", True),
+        ("[y async for y in x]", True),
+    ],
+)
+def test_uses_await(code, expected):
+    assert interpret.uses_await(code) == expected
+
+
+def test_build_batch_function_keep_inputs():
+    function = interpret.build_batch_function(
+        "len", {}, interpret.HowCall.SINGLE, keep_inputs=True
+    )
+    assert not function.is_async
+    assert function.wrapped(["", "a", "", "b"]) == ["a", "b"]
+
+
+def test_build_fused_function():
+    stages = [
+        ("map", interpret.build_function("int", {}, interpret.HowCall.SINGLE)),
+        ("filter", interpret.build_function("x % 2", {}, interpret.HowCall.SINGLE)),
+        ("map", interpret.build_function("x * 10", {}, interpret.HowCall.SINGLE)),
+    ]
+    function = interpret.build_fused_function(stages)
+    assert not function.is_async
+    assert function.wrapped("3") == 30
+    assert function.wrapped("4") is interpret.SKIP
+
+
+def test_build_function_reuses_cached_code(monkeypatch):
+    code = "collections.Counter ! len"
+    function = interpret.build_function(code, {}, interpret.HowCall.SINGLE)
+    assert function.wrapped("aab") == 2
+
+    def fail(*args):
+        raise AssertionError("the code was compiled again")
+
+    monkeypatch.setattr(interpret, "split_pipestring", fail)
+    monkeypatch.setattr(interpret, "build_name_to_module", fail)
+    cached = interpret.build_function(code, {}, interpret.HowCall.SINGLE)
+    assert cached.wrapped("aab") == 2
+    assert cached.source == function.source
+
+    with pytest.raises(AssertionError):
+        interpret.build_function(code, {}, interpret.HowCall.SINGLE, use_cache=False)
+
+
+def test_build_function_recompiles_when_a_module_is_added(tmp_path, monkeypatch):
+    monkeypatch.setattr(interpret, "MISSING_MODULES", interpret.MissingModules())
+    monkeypatch.syspath_prepend(str(tmp_path))
+    name = f"mario_test_cached_module_{os.getpid()}"
+    code = f"{name}.f(x)"
+    with pytest.raises(NameError):
+        interpret.build_function(code, {}, interpret.HowCall.SINGLE).wrapped("a")
+
+    (tmp_path / f"{name}.py").write_text("f = str.upper\n")
+    os.utime(tmp_path, ns=(0, 1))
+    function = interpret.build_function(code, {}, interpret.HowCall.SINGLE)
+    assert function.wrapped("a") == "A"
+
+
+def test_build_function_without_await_is_plain():
+    function = interpret.build_function("str.upper", {}, interpret.HowCall.SINGLE)
+    assert not function.is_async
+    assert function.wrapped("a") == "A"
+
+
+def test_build_function_with_await_is_async():
+    function = interpret.build_function(
+        "await asks.get(x)", {}, interpret.HowCall.SINGLE
+    )
+    assert function.is_async
+    assert function.source.startswith("async def")
+
+
+def test_stage_label():
+    assert interpret.stage_label(3, "map", "json.loads") == "stage 3: map 'json.loads'"
+    long_label = interpret.stage_label(1, "map", "x +\n" + "1 + " * 20 + "1")
+    assert long_label == "stage 1: map 'x + 1 + 1 + 1 + 1 + 1 + 1 + 1 + 1 + 1...'"
+
+
+def test_build_function_names_the_stage():
+    label = "stage 2: map 'str.upper'"
+    function = interpret.build_function(
+        "str.upper", {}, interpret.HowCall.SINGLE, name=label
+    )
+    code = function.wrapped.__code__
+    assert code.co_name == "_mario_stage_2_map_str_upper"
+    assert code.co_filename == "<stage 2: map 'str.upper'>"
+    assert linecache.getline(code.co_filename, 2).strip() == "x = str.upper(x)"
+    assert function.name == label
@@ -0,0 +1,43 @@
+import json
+import time
+
+import trio
+
+from mario import loopstats
+
+from . import helpers
+
+
+def test_loop_stats_names_slow_slices_after_tasks():
+    summaries = []
+    instrument = loopstats.LoopStats(summaries.append, interval=60)
+
+    async def blocking():
+        time.sleep(0.06)
+
+    async def main():
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(blocking, name="stage 1: async_map 'blocking'")
+            nursery.start_soon(trio.sleep, 0)
+
+    trio.run(main, instruments=[instrument])
+
+    [summary] = summaries
+    assert summary["final"]
+    assert summary["tasks"] == 0
+    assert summary["peak_tasks"] >= 3
+    assert summary["slow_slices"] == 1
+    assert summary["longest_slices"][0]["task"] == "stage 1: async_map 'blocking'"
+    assert summary["lag_max_seconds"] >= 0.05
+
+
+def test_loop_stats_file(tmp_path):
+    path = tmp_path / "loop.jsonl"
+    args = ["--loop-stats-file", str(path), "async-map", "time.sleep(0.06) or x"]
+    output = helpers.run(args, input=b"a\n").decode()
+    assert output == "a\n"
+
+    summaries = [json.loads(line) for line in path.read_text().splitlines()]
+    assert summaries[-1]["final"]
+    slices = [s for summary in summaries for s in summary["longest_slices"]]
+    assert "stage 1: async_map 'time.sleep(0.06) or x'" in {s["task"] for s in slices}
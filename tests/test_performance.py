@@ -1,6 +1,16 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
 from tests import helpers
 
 
+BENCHMARK_LINES = int(os.environ.get("MARIO_BENCHMARK_LINES", 10 ** 6))
+
+
 def test_eval_1_is_fast():
     """``eval `` should be very quick."""
     # This should ideally be below 0.1s.
@@ -8,3 +18,118 @@ def test_eval_1_is_fast():
         output = helpers.run(["eval", "1"]).decode()
 
     assert output == "1\n"
+
+
+def test_eval_1_skips_heavy_imports():
+    """Startup loads declarative commands from the snapshot, not from TOML."""
+    helpers.run(["eval", "1"])
+    source = (
+        "import sys\n"
+        "sys.argv = ['mario', 'eval', '1']\n"
+        "import mario.cli\n"
+        "try:\n"
+        "    mario.cli.cli()\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "heavy = ['marshmallow', 'parso', 'toml', 'yaml', 'xmltodict']\n"
+        "print(sorted(set(heavy) & set(sys.modules)))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", source], capture_output=True, check=True
+    ).stdout.decode()
+
+    assert output == "1\n[]\n"
+
+
+def test_serve_is_faster_than_cold_start(tmp_path):
+    """Commands sent to ``mario serve`` skip interpreter and plugin startup."""
+    env = dict(os.environ, MARIO_SOCKET=str(tmp_path / "mario.sock"))
+    server = subprocess.Popen([sys.executable, "-m", "mario", "serve"], env=env)
+    try:
+        for _ in range(200):
+            if os.path.exists(env["MARIO_SOCKET"]):
+                break
+            time.sleep(0.05)
+        else:
+            raise TimeoutError("mario serve did not start")
+
+        client = [sys.executable, "-m", "mario.client", "eval", "1"]
+        cold = [sys.executable, "-m", "mario", "eval", "1"]
+        with helpers.Timer() as cold_timer:
+            for _ in range(10):
+                assert subprocess.check_output(cold, env=env) == b"1\n"
+
+        with helpers.Timer(max=cold_timer.elapsed):
+            for _ in range(10):
+                assert subprocess.check_output(client, env=env) == b"1\n"
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def test_async_map_unordered_slow_tail_is_idle():
+    """Waiting on a slow final item should not spend CPU time."""
+    with helpers.ChildCpuTimer() as baseline:
+        helpers.run(["eval", "1"])
+
+    stdin = b"0\n" * 20 + b"3\n"
+    args = ["async-map-unordered", "await trio.sleep(float(x)) or x"]
+
+    with helpers.ChildCpuTimer(max=baseline.elapsed + 1.0):
+        output = helpers.run(args, input=stdin).decode()
+
+    assert output == "0\n" * 20 + "3\n"
+
+
+def test_batch_filter_is_faster_than_per_item_filter():
+    """``--batch-size`` removes most of the per-line overhead of ``filter``.
+
+    Set ``MARIO_BENCHMARK_LINES`` to change the input size, for example to
+    ``10000000``.
+    """
+    stdin = "".join(f"{i}\n" for i in range(BENCHMARK_LINES)).encode()
+    args = ["filter", "--batch-size", "10000", 'x == "-1"']
+
+    with helpers.Timer() as per_item:
+        per_item_output = helpers.run(["filter", 'x == "-1"'], input=stdin)
+
+    with helpers.Timer(max=per_item.elapsed):
+        batch_output = helpers.run(args, input=stdin)
+
+    assert per_item_output == batch_output == b""
+
+
+def test_libyaml_loader_is_faster_than_pure_python_loader():
+    """``read-yaml-docs`` and ``read-yaml`` use libyaml when it is available.
+
+    Set ``MARIO_BENCHMARK_LINES`` to change the input size.
+    """
+    yaml = pytest.importorskip("yaml")
+    if not yaml.__with_libyaml__:
+        pytest.skip("PyYAML was built without libyaml.")
+    text = "".join(
+        f"---\nid: {i}\nname: item {i}\ntags: [a, b]\n"
+        for i in range(BENCHMARK_LINES // 100)
+    )
+
+    with helpers.Timer() as pure:
+        pure_documents = list(yaml.load_all(text, Loader=yaml.SafeLoader))
+
+    with helpers.Timer(max=pure.elapsed):
+        libyaml_documents = list(yaml.load_all(text, Loader=yaml.CSafeLoader))
+
+    assert libyaml_documents == pure_documents
+
+
+def test_importing_cli_does_not_build_registry():
+    source = (
+        "import mario.cli\n"
+        "print(mario.app.get_global_registry.cache_info().currsize)\n"
+        "'eval' in mario.cli.COMMANDS\n"
+        "print(mario.app.get_global_registry.cache_info().currsize)\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", source], capture_output=True, check=True
+    ).stdout.decode()
+
+    assert output == "0\n1\n"
@@ -0,0 +1,93 @@
+import pickle
+
+import pytest
+
+from mario import plug
+
+
+CONF = {
+    "command": [
+        {
+            "name": "jsonl",
+            "short_help": "Load jsonlines into python objects",
+            "stages": [{"command": "map", "params": {"code": "json.loads"}}],
+        }
+    ]
+}
+
+
+def test_lazy_commands_reuse_snapshot():
+    loads = []
+
+    def load_confs():
+        loads.append(1)
+        return [CONF]
+
+    commands = plug.LazyCommands(load_confs, fingerprint=lambda: "v1")
+    assert list(commands) == ["jsonl"]
+    assert commands["jsonl"].stages[0].params["code"] == "json.loads"
+
+    snapshot = plug.LazyCommands(load_confs, fingerprint=lambda: "v1")
+    assert snapshot["jsonl"] == commands["jsonl"]
+    assert len(loads) == 1
+
+    changed = plug.LazyCommands(lambda: [{"command": []}], fingerprint=lambda: "v2")
+    assert "jsonl" not in changed
+
+
+def test_lazy_commands_report_invalid_commands_when_used():
+    conf = {"command": [CONF["command"][0], {"name": "broken", "stages": 1}]}
+    commands = plug.LazyCommands(lambda: [conf], fingerprint=lambda: "broken")
+
+    assert commands["jsonl"].name == "jsonl"
+    with pytest.raises(Exception):
+        commands["broken"]  # pylint: disable=pointless-statement
+
+
+def test_lazy_commands_check_names_without_loading_commands():
+    loads = []
+
+    def load_confs():
+        loads.append(1)
+        return [CONF]
+
+    assert "jsonl" in plug.LazyCommands(load_confs, fingerprint=lambda: "names")
+    assert len(loads) == 1
+
+    commands = plug.LazyCommands(lambda: pytest.fail(), fingerprint=lambda: "names")
+    assert "jsonl" in commands
+    assert "map" not in commands
+    assert commands._confs is None  # pylint: disable=protected-access
+
+
+def test_lazy_commands_replace_unreadable_snapshot(monkeypatch):
+    plug.LazyCommands(lambda: [CONF], fingerprint=lambda: "stale")["jsonl"]
+
+    failures = [pickle.UnpicklingError]
+    real_loads = pickle.loads
+
+    def loads(data):
+        if failures:
+            raise failures.pop()
+        return real_loads(data)
+
+    monkeypatch.setattr(plug.pickle, "loads", loads)
+    commands = plug.LazyCommands(lambda: [CONF], fingerprint=lambda: "stale")
+    assert commands["jsonl"].name == "jsonl"
+    assert not failures
+
+    snapshot = plug.LazyCommands(lambda: pytest.fail(), fingerprint=lambda: "stale")
+    assert snapshot["jsonl"].name == "jsonl"
+
+
+def test_lazy_commands_snapshot_depends_on_versions(monkeypatch):
+    loads = []
+
+    def load_confs():
+        loads.append(1)
+        return [CONF]
+
+    plug.LazyCommands(load_confs, fingerprint=lambda: "versions")["jsonl"]
+    monkeypatch.setattr(plug, "snapshot_versions", lambda: ("click==0",))
+    plug.LazyCommands(load_confs, fingerprint=lambda: "versions")["jsonl"]
+    assert len(loads) == 2
@@ -10,6 +10,7 @@ import pytest
 import mario.declarative
 import mario.plug
 import mario.plugins
+import mario.plugins.write
 
 
 REGISTRY = mario.plug.make_plugin_commands_registry()
@@ -65,3 +66,7 @@ def test_invocation_includes_command(command):
     for test in command.tests:
         message = f"The tested command {command.name} is not in the invocation {test.invocation}."
         assert command.name in test.invocation, message
+
+
+def test_write_yaml_keeps_python_types():
+    assert mario.plugins.write.write_yaml((1, 2)) == "!!python/tuple\n- 1\n- 2\n"
@@ -0,0 +1,48 @@
+import trio
+
+from mario import interpret
+from mario import traversals
+
+from . import helpers
+
+
+def test_process_map_leaves_default_thread_limiter_free():
+    code = "time.sleep(0.3) or x * 2"
+    spec = interpret.FunctionSpec(code, interpret.HowCall.SINGLE)
+
+    async def main():
+        limiter = trio.to_thread.current_default_thread_limiter()
+        items = helpers.aiter_list(["a", "b", "c", "d"])
+        async with traversals.process_map(spec, items, 1, 2) as results:
+            return [(result, limiter.borrowed_tokens) async for result in results]
+
+    assert trio.run(main) == [("aa", 0), ("bb", 0), ("cc", 0), ("dd", 0)]
+
+
+def test_process_map_cancel_keeps_loop_running():
+    code = "time.sleep(float(x)) or x"
+    spec = interpret.FunctionSpec(code, interpret.HowCall.SINGLE)
+    lines = ["2"] * 8
+
+    async def main():
+        ticks = []
+
+        async def tick():
+            while True:
+                ticks.append(trio.current_time())
+                await trio.sleep(0.1)
+
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(tick)
+            with trio.move_on_after(0.5):
+                items = helpers.aiter_list(lines)
+                async with traversals.process_map(spec, items, 1, 1) as results:
+                    assert [result async for result in results] == []
+            nursery.cancel_scope.cancel()
+        return ticks
+
+    ticks = trio.run(main)
+    # Only the batches already handed to the worker are waited for, and the
+    # loop keeps running while the pool shuts down.
+    assert ticks[-1] - ticks[0] < 6
+    assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.5
@@ -2,6 +2,13 @@ import csv
 import subprocess
 import sys
 
+import trio
+
+from mario import asynch
+from mario import traversals
+
+from . import helpers
+
 
 def make_reader():
     field_names = None
@@ -105,3 +112,46 @@ def test_apply_csv_dictreader_read_csv():
         expected = "[{'name': 'alice', 'age': '21'}, {'name': 'bob', 'age': '22'}]\n"
 
         assert output == expected
+
+
+def read_csv_rows(lines, **kwargs):
+    async def main():
+        async with traversals.read_csv(helpers.aiter_list(lines), **kwargs) as rows:
+            return [row async for row in rows]
+
+    return trio.run(main)
+
+
+def test_read_csv_quoted_newlines():
+    lines = ["name,note", 'alice,"one', "two", 'three"', "bob,plain"]
+    assert read_csv_rows(lines, as_dicts=True) == [
+        {"name": "alice", "note": "one\ntwo\nthree"},
+        {"name": "bob", "note": "plain"},
+    ]
+
+
+def test_read_csv_tuples_from_batches():
+    batches = [["a,b", '"c'], ['d",e', ""], ["f,g"]]
+
+    async def main():
+        items = asynch.Batched(helpers.aiter_list(batches))
+        async with traversals.read_csv(items) as rows:
+            return [row async for row in rows]
+
+    assert trio.run(main) == [("a", "b"), ("c\nd", "e"), (), ("f", "g")]
+
+
+def test_read_csv_unterminated_quote_at_end():
+    assert read_csv_rows(["a,b", 'c,"d']) == [("a", "b"), ("c", "d\n")]
+
+
+def test_read_csv_dicts_command_streams_records():
+    input_ = b'name,note\nalice,"line one\nline two"\nbob,plain\n'
+    output = subprocess.check_output(
+        [sys.executable, "-m", "mario", "read-csv-dicts"], input=input_
+    ).decode()
+    expected = (
+        "{'name': 'alice', 'note': 'line one\\nline two'}\n"
+        "{'name': 'bob', 'note': 'plain'}\n"
+    )
+    assert output == expected
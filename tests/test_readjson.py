@@ -0,0 +1,46 @@
+import json
+
+import pytest
+import trio
+
+from mario import traversals
+
+from . import helpers
+
+
+def read_json_array(lines):
+    async def main():
+        async with traversals.read_json_array(helpers.aiter_list(lines)) as elements:
+            return [element async for element in elements]
+
+    return trio.run(main)
+
+
+def test_read_json_array_elements_spanning_lines():
+    lines = ["[", ' {"a": [1,', " 2]}, 3,", '"x" , null', "]"]
+    assert read_json_array(lines) == [{"a": [1, 2]}, 3, "x", None]
+
+
+def test_read_json_array_empty():
+    assert read_json_array(["  [ ]  "]) == []
+
+
+@pytest.mark.parametrize("lines", [["[1,"], ["[1] 2"], ["[1 2]"], ["{}"], ["[1,]"], []])
+def test_read_json_array_invalid(lines):
+    with pytest.raises(json.JSONDecodeError):
+        read_json_array(lines)
+
+
+def test_read_json_array_emits_elements_before_the_end():
+    send_channel, receive_channel = trio.open_memory_channel(1)
+
+    async def main():
+        async with traversals.read_json_array(receive_channel) as elements:
+            elements = elements.__aiter__()
+            async with send_channel:
+                await send_channel.send('[{"a": 1},')
+                assert await elements.__anext__() == {"a": 1}
+                await send_channel.send('{"b": 2}]')
+            return [element async for element in elements]
+
+    assert trio.run(main) == [{"b": 2}]
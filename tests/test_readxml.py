@@ -0,0 +1,42 @@
+import xml.parsers.expat
+
+import pytest
+import trio
+
+from mario import asynch
+from mario import traversals
+
+from . import helpers
+
+
+def read_xml(items, record_path="", **kwargs):
+    async def main():
+        async with traversals.read_xml(items, record_path, **kwargs) as records:
+            return [record async for record in records]
+
+    return trio.run(main)
+
+
+def test_read_xml_records_from_batches():
+    batches = [["<feed>", "<entry>"], ["<title>One</title></entry>"], ["<skip/>"]]
+    batches += [['<entry lang="en"><title>Two</title></entry>', "</feed>"]]
+    records = read_xml(asynch.Batched(helpers.aiter_list(batches)), "/feed/entry")
+    assert records == [{"title": "One"}, {"@lang": "en", "title": "Two"}]
+
+
+def test_read_xml_whole_document():
+    lines = ["<a>", "<b>1</b>", "<b>2</b>", "</a>"]
+    records = read_xml(helpers.aiter_list(lines), dict_constructor=dict)
+    assert records == [{"a": {"b": ["1", "2"]}}]
+
+
+def test_read_xml_namespaced_records():
+    lines = ['<f:feed xmlns:f="urn:f">', "<f:entry>1</f:entry>", "</f:feed>"]
+    path = "urn:f:feed/urn:f:entry"
+    records = read_xml(helpers.aiter_list(lines), path, process_namespaces=True)
+    assert records == ["1"]
+
+
+def test_read_xml_unclosed_document():
+    with pytest.raises(xml.parsers.expat.ExpatError):
+        read_xml(helpers.aiter_list(["<a>"]), "/a/b")
@@ -0,0 +1,30 @@
+import pytest
+import trio
+import yaml
+
+from mario import asynch
+from mario import traversals
+
+from . import helpers
+
+
+def read_yaml_documents(items):
+    async def main():
+        async with traversals.read_yaml_documents(items) as documents:
+            return [document async for document in documents]
+
+    return trio.run(main)
+
+
+@pytest.mark.parametrize("libyaml", [True, False])
+def test_read_yaml_documents_from_batches(libyaml, monkeypatch):
+    if not libyaml:
+        monkeypatch.delattr(yaml, "CSafeLoader", raising=False)
+    batches = [["a: 1", "---", "- x"], ["- y"], [], ["--- hello", "..."]]
+    documents = read_yaml_documents(asynch.Batched(helpers.aiter_list(batches)))
+    assert documents == [{"a": 1}, ["x", "y"], "hello"]
+
+
+def test_read_yaml_documents_error():
+    with pytest.raises(yaml.YAMLError):
+        read_yaml_documents(helpers.aiter_list(["a: 1", "---", "b: [1"]))
@@ -0,0 +1,99 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+
+def run_client(args, env, check=True, **kwargs):
+    return subprocess.run(
+        [sys.executable, "-m", "mario.client"] + args,
+        env=env,
+        capture_output=True,
+        check=check,
+        **kwargs,
+    )
+
+
+def start_server(env):
+    proc = subprocess.Popen([sys.executable, "-m", "mario", "serve"], env=env)
+    for _ in range(200):
+        if os.path.exists(env["MARIO_SOCKET"]):
+            return proc
+        time.sleep(0.05)
+    proc.kill()
+    proc.wait()
+    raise TimeoutError("mario serve did not start")
+
+
+@pytest.fixture(name="server_env")
+def _server_env(tmp_path):
+    env = os.environ.copy()
+    env["MARIO_SOCKET"] = str(tmp_path / "mario.sock")
+    proc = start_server(env)
+    try:
+        yield env
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def test_client_runs_pipeline(server_env):
+    output = run_client(["map", "x.upper()"], server_env, input=b"a\nb\n").stdout
+    assert output == b"A\nB\n"
+
+
+def test_client_runs_in_its_working_directory(server_env, tmp_path):
+    output = run_client(["eval", "os.getcwd()"], server_env, cwd=tmp_path).stdout
+    assert output.decode() == f"{tmp_path}\n"
+
+
+def test_requests_do_not_share_namespaces(server_env):
+    output = run_client(["--exec-before", "y = 1", "eval", "y"], server_env).stdout
+    assert output == b"1\n"
+
+    proc = run_client(["eval", "y"], server_env, check=False)
+    assert proc.returncode == 1
+    assert b"NameError" in proc.stderr
+
+    assert run_client(["eval", "2"], server_env).stdout == b"2\n"
+
+
+def test_client_reports_usage_errors(server_env):
+    proc = run_client(["no-such-command"], server_env, check=False)
+    assert proc.returncode == 2
+    assert b"No such command" in proc.stderr
+
+
+def test_client_receives_stats(server_env):
+    proc = run_client(["--stats", "map", "x"], server_env, input=b"a\n")
+    assert proc.stdout == b"a\n"
+    assert b"items/s" in proc.stderr
+
+
+@pytest.mark.parametrize("option", [["--profile", "p"], ["--loop-stats"]])
+def test_client_rejects_process_options(server_env, option):
+    proc = run_client(option + ["eval", "1"], server_env, check=False)
+    assert proc.returncode == 2
+    assert f"{option[0]} cannot be used with mario serve".encode() in proc.stderr
+
+
+def test_server_removes_socket_on_sigterm(tmp_path):
+    env = dict(os.environ, MARIO_SOCKET=str(tmp_path / "mario.sock"))
+    proc = start_server(env)
+    proc.terminate()
+    assert proc.wait(timeout=10) == 0
+    assert not os.path.exists(env["MARIO_SOCKET"])
+
+
+def test_client_runs_mario_without_server(tmp_path):
+    env = dict(os.environ, MARIO_SOCKET=str(tmp_path / "missing.sock"))
+    assert run_client(["eval", "1"], env).stdout == b"1\n"
+
+
+def test_client_reports_stage_usage_errors(server_env):
+    args = ["process-map", "await trio.sleep(0) or x"]
+    proc = run_client(args, server_env, check=False, input=b"1\n")
+    assert proc.returncode == 2
+    assert proc.stderr == b"Error: process-map does not support await\n"
@@ -0,0 +1,93 @@
+import json
+
+import pytest
+import trio
+
+from mario import asynch
+from mario import stats
+from mario import traversals
+
+from . import helpers
+
+
+def test_meter_counts_items_and_keeps_batches():
+    producer = stats.StageStats("input")
+    consumer = stats.StageStats("stage 1")
+    items = asynch.Batched(helpers.aiter_list([["a", "b"], ["c"]]))
+
+    async def main():
+        metered = stats.Meter(items, producer, consumer).metered()
+        assert isinstance(metered, asynch.Batched)
+        return [item async for item in metered]
+
+    assert trio.run(main) == ["a", "b", "c"]
+    assert producer.items == 3
+    assert consumer.upstream_time == producer.wait_time > 0
+
+
+def test_async_map_reports_latency_and_in_flight():
+    stage = stats.StageStats("stage 1")
+
+    async def function(x):
+        await trio.sleep(0.01)
+        return x * 2
+
+    async def main():
+        mapper = traversals.async_map(
+            function, helpers.aiter_list(range(10)), 4, stats=stage
+        )
+        async with mapper as results:
+            return [item async for item in results]
+
+    assert trio.run(main) == [x * 2 for x in range(10)]
+    assert len(stage.latencies) == 10
+    assert stage.peak_in_flight >= 4
+    assert stage.in_flight == 0
+    p50, p99 = stage.percentiles(0.5, 0.99)
+    assert 0.01 <= p50 <= p99
+
+
+def test_stats_json(tmp_path):
+    path = tmp_path / "stats.json"
+    args = ["--stats-json", str(path), "map", "int", "async-filter", "x % 2"]
+    output = helpers.run(args, input=b"1\n2\n3\n").decode()
+    assert output == "1\n3\n"
+
+    stages = json.loads(path.read_text())
+    assert [s["stage"] for s in stages] == [
+        "input",
+        "stage 1: map 'int'",
+        "stage 2: async_filter 'x % 2'",
+    ]
+    assert [s["items"] for s in stages] == [3, 3, 2]
+    assert stages[2]["latency_p50"] is not None
+    assert stages[1]["latency_p50"] is None
+
+
+def test_stats_keep_fusible_stages_apart(tmp_path):
+    path = tmp_path / "stats.json"
+    args = ["--stats-json", str(path), "map", "int", "filter", "x % 2", "map", "x * -1"]
+    output = helpers.run(args, input=b"1\n2\n3\n").decode()
+    assert output == "-1\n-3\n"
+
+    stages = json.loads(path.read_text())
+    assert [s["stage"] for s in stages] == [
+        "input",
+        "stage 1: map 'int'",
+        "stage 2: filter 'x % 2'",
+        "stage 3: map 'x * -1'",
+    ]
+    assert [s["items"] for s in stages] == [3, 3, 2, 2]
+
+
+def test_latency_sample_is_bounded():
+    stage = stats.StageStats("stage 1")
+    count = 10 * stats.LATENCY_SAMPLE_SIZE
+    for i in range(count):
+        stage.record_latency(i / count)
+
+    assert len(stage.latencies) == stats.LATENCY_SAMPLE_SIZE
+    assert stage.latency_count == count
+    assert stage.busy_time == pytest.approx((count - 1) / 2)
+    [p50] = stage.percentiles(0.5)
+    assert 0.45 < p50 < 0.55
@@ -0,0 +1,57 @@
+import json
+
+import trio
+
+from mario import tracing
+from mario import traversals
+
+from . import helpers
+
+
+def test_tracer_keeps_the_last_spans():
+    tracer = tracing.Tracer(max_spans=3)
+    stage = tracer.stage("stage 1")
+    for _ in range(5):
+        stage.start_item().mark("call")
+
+    trace = tracer.to_json()
+    assert [event["id"] for event in trace["traceEvents"]] == [2, 2, 3, 3, 4, 4]
+    assert [event["ph"] for event in trace["traceEvents"]] == ["b", "e"] * 3
+    assert trace["otherData"] == {"dropped_spans": 2}
+
+
+def test_async_map_records_item_phases():
+    tracer = tracing.Tracer()
+
+    async def function(x):
+        await trio.sleep(0.01 * (2 - x))
+        return x
+
+    async def main():
+        mapper = traversals.async_map(
+            function, helpers.aiter_list(range(3)), 3, trace=tracer.stage("stage 1")
+        )
+        async with mapper as results:
+            return [item async for item in results]
+
+    assert trio.run(main) == [0, 1, 2]
+    phases = {}
+    for name, label, item_id, start, end in tracer.spans:
+        assert label == "stage 1"
+        assert start <= end
+        phases.setdefault(item_id, []).append(name)
+    assert phases == {
+        item_id: ["wait for limiter", "call", "wait for previous item", "send"]
+        for item_id in range(3)
+    }
+
+
+def test_trace_option(tmp_path):
+    path = tmp_path / "trace.json"
+    args = ["--trace", str(path), "async-map", "x.upper()"]
+    output = helpers.run(args, input=b"a\nb\n").decode()
+    assert output == "A\nB\n"
+
+    events = json.loads(path.read_text())["traceEvents"]
+    assert {event["cat"] for event in events} == {"stage 1: async_map 'x.upper()'"}
+    assert len(events) == 2 * 2 * 4